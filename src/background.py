@@ -0,0 +1,200 @@
+"""!@file background.py
+@brief      Learns the static heat in the camera's view so people stand out.
+@details    Contains a per-pixel background model: an exponential moving
+            average of each raw pixel, kept in fixed point in a preallocated
+            array. As each subpage arrives, only that subpage's pixels are
+            updated, and the difference between each pixel and its background
+            is written to a preallocated foreground image. Detectors such as
+            @c targeting.locate() can then search the foreground, where lamps,
+            electronics and warm surfaces have faded to zero.
+
+            Pixels much warmer than their background are learned more slowly,
+            so someone standing still is not absorbed into the background
+            within a few frames, while heat sources that stay put long enough
+            eventually are. Learning can also be frozen, such as while the
+            opponent is known to be standing in view.
+
+            If the board supports MicroPython's viper code emitter, the update
+            in @c background_viper.py is used; otherwise the pure Python one
+            below is used, which gives identical results.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+# Import necessary modules.
+from array import array
+
+try:
+    from background_viper import update_background as update_background_viper
+except (ImportError, SyntaxError, NameError):
+    # No viper code emitter on this port (or not running MicroPython at all).
+    update_background_viper = None
+
+## Number of fractional bits the background is stored with.
+FRACTION_BITS = 8
+
+
+def update_background(pix, bg, fg, table, count, shift, slow_shift, threshold):
+    """!@brief          Updates the background and foreground of some pixels.
+        @details        Pure Python version of the kernel. For each pixel
+                        index in @c table, the foreground becomes the pixel
+                        minus its background, and the background moves toward
+                        the pixel by @c 2**-shift of the difference, or by
+                        @c 2**-slow_shift if the foreground is above
+                        @c threshold.
+        @param pix      The raw pixel data, an @c array('h').
+        @param bg       The background, an @c array('l') in fixed point with
+                        @c FRACTION_BITS fractional bits.
+        @param fg       The foreground, an @c array('h').
+        @param table    Indices of the pixels to update, an @c array('H').
+        @param count    How many entries of @c table to use.
+        @param shift    The learning rate as a power of two.
+        @param slow_shift The learning rate for warm foreground pixels.
+        @param threshold The foreground level above which @c slow_shift is used.
+    """
+    for n in range(count):
+        idx = table[n]
+        diff = (pix[idx] << FRACTION_BITS) - bg[idx]
+        level = diff >> FRACTION_BITS
+        if level > 32767:
+            level = 32767
+        elif level < -32768:
+            level = -32768
+        fg[idx] = level
+        if level > threshold:
+            bg[idx] += diff >> slow_shift
+        else:
+            bg[idx] += diff >> shift
+
+
+class BackgroundModel:
+    """!@brief      A running estimate of each pixel's background level.
+    """
+
+    def __init__(self, size=768, shift=5, slow_shift=10, threshold=60):
+        """!@brief          Creates a background model with no history.
+            @param size     The number of pixels in the image.
+            @param shift    The learning rate as a power of two; each update
+                            moves a pixel's background by @c 2**-shift of its
+                            difference, so 5 takes around 32 frames to learn.
+            @param slow_shift The learning rate for pixels warmer than their
+                            background by more than @c threshold.
+            @param threshold Raw counts above the background at which a pixel
+                            is considered to be part of a person.
+        """
+        ## The learning rate as a power of two.
+        self.shift = shift
+        ## The learning rate for warm foreground pixels.
+        self.slow_shift = slow_shift
+        ## Foreground level in raw counts above which learning is slowed.
+        self.threshold = threshold
+        ## Background of each pixel, in fixed point.
+        self.bg = array('l', [0] * size)
+        ## Each pixel minus its background, in raw counts.
+        self.fg = array('h', [0] * size)
+        ## Whether every pixel's background has been started from an image.
+        self.primed = False
+        ## While @c True, the foreground is updated but the background isn't.
+        self.frozen = False
+        # Which pixels' backgrounds have been started, and how many haven't
+        self._started = bytearray(size)
+        self._unstarted = size
+
+    def prime(self, pix, table):
+        """!@brief          Starts the background of some pixels from an image.
+            @details        Pixels whose background has already been started
+                            are left alone.
+            @param pix      The raw pixel data, an @c array('h').
+            @param table    Indices of the pixels which were read.
+        """
+        bg = self.bg
+        fg = self.fg
+        started = self._started
+        for idx in table:
+            if not started[idx]:
+                bg[idx] = pix[idx] << FRACTION_BITS
+                fg[idx] = 0
+                started[idx] = 1
+                self._unstarted -= 1
+        self.primed = not self._unstarted
+
+    def update(self, pix, table, native=True):
+        """!@brief          Updates the pixels which were just read.
+            @details        Each pixel's background is started from its value
+                            the first time it is read, as only one subpage,
+                            or a region of interest, is read at a time.
+            @param pix      The raw pixel data, an @c array('h').
+            @param table    Indices of the pixels which were read, such as
+                            @c Subpage.sp_range().
+            @param native   Whether to use the viper kernel if it is available.
+        """
+        if not self.primed:
+            self.prime(pix, table)
+        if self.frozen:
+            self._subtract(pix, table)
+            return
+        if native and update_background_viper is not None:
+            update_background_viper(pix, self.bg, self.fg, table, len(table),
+                                    self.shift, self.slow_shift,
+                                    self.threshold)
+        else:
+            update_background(pix, self.bg, self.fg, table, len(table),
+                              self.shift, self.slow_shift, self.threshold)
+
+    def _subtract(self, pix, table):
+        # Foreground only, for while learning is frozen
+        bg = self.bg
+        fg = self.fg
+        for idx in table:
+            level = ((pix[idx] << FRACTION_BITS) - bg[idx]) >> FRACTION_BITS
+            if level > 32767:
+                level = 32767
+            elif level < -32768:
+                level = -32768
+            fg[idx] = level
+
+
+if __name__ == "__main__":
+    # Learn a scene with a lamp in it, then have someone walk in.
+    try:
+        from utime import ticks_us, ticks_diff
+    except ImportError:
+        from time import perf_counter
+
+        def ticks_us():
+            return int(perf_counter() * 1_000_000)
+
+        def ticks_diff(end, start):
+            return end - start
+
+    width = 32
+    scene = array('h', [600] * 768)
+    for idx in range(5 * width + 2, 5 * width + 5):
+        scene[idx] = 2000  # the lamp
+    tables = (array('H', range(0, 768, 2)), array('H', range(1, 768, 2)))
+
+    model = BackgroundModel()
+    for n in range(200):
+        model.update(scene, tables[n % 2])
+    for idx in range(6 * width + 20, 6 * width + 23):
+        scene[idx] = 1500  # the person
+    t_start = ticks_us()
+    for n in range(10):
+        model.update(scene, tables[n % 2])
+    per_call = ticks_diff(ticks_us(), t_start) / 10
+    print(f'lamp foreground {model.fg[5 * width + 3]}, '
+          f'person foreground {model.fg[6 * width + 21]}, '
+          f'{per_call:.0f} us per subpage')
+
+    # Someone standing still is only learned while learning isn't frozen.
+    model.frozen = True
+    for n in range(400):
+        model.update(scene, tables[n % 2])
+    frozen_fg = model.fg[6 * width + 21]
+    model.frozen = False
+    for n in range(400):
+        model.update(scene, tables[n % 2])
+    print(f'person foreground {frozen_fg} after 200 frozen frames, '
+          f'{model.fg[6 * width + 21]} after 200 more')
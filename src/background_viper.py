@@ -0,0 +1,49 @@
+"""!@file background_viper.py
+@brief      Viper version of the background update in background.py.
+@details    This is compiled to machine code by MicroPython's viper emitter,
+            so it only loads on boards which support it; @c background.py
+            falls back to its pure Python kernel otherwise. It must give
+            exactly the same results as its Python twin.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+import micropython
+
+
+@micropython.viper
+def update_background(pix: ptr16, bg: ptr32, fg: ptr16, table: ptr16,
+                      count: int, shift: int, slow_shift: int,
+                      threshold: int):
+    """!@brief          Viper version of @c background.update_background().
+        @param pix      The raw pixel data, an @c array('h').
+        @param bg       The background, an @c array('l') in fixed point with
+                        8 fractional bits.
+        @param fg       The foreground, an @c array('h').
+        @param table    Indices of the pixels to update, an @c array('H').
+        @param count    How many entries of @c table to use.
+        @param shift    The learning rate as a power of two.
+        @param slow_shift The learning rate for warm foreground pixels.
+        @param threshold The foreground level above which @c slow_shift is used.
+    """
+    n = 0
+    while n < count:
+        idx = int(table[n])
+        # ptr16 reads are unsigned, so sign-extend the pixel value.
+        val = int(pix[idx])
+        if val & 0x8000:
+            val -= 0x10000
+        diff = (val << 8) - int(bg[idx])
+        level = diff >> 8
+        if level > 32767:
+            level = 32767
+        elif level < -32768:
+            level = -32768
+        fg[idx] = level
+        if level > threshold:
+            bg[idx] = int(bg[idx]) + (diff >> slow_shift)
+        else:
+            bg[idx] = int(bg[idx]) + (diff >> shift)
+        n += 1
@@ -0,0 +1,214 @@
+"""!@file cam_tuning.py
+@brief      Chooses the I2C bus speed and camera refresh rate at startup.
+@details    The camera's frames are only as fresh as the time it takes to
+            measure a subpage plus the time it takes to read it over I2C.
+            @c tune_camera() measures how long a subpage read actually takes
+            at each candidate bus frequency, checking that the EEPROM reads
+            back identically so a bus which is too fast for the wiring is not
+            used. It then picks the quietest refresh rate whose worst case
+            latency meets the budget, sets the camera to it, and reports the
+            numbers it measured.
+
+            Frequencies above 400 kHz use I2C Fast-mode Plus, which the camera
+            enables through its I2C configuration register; note that the
+            register's FM+ bit is active low.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+# Import necessary modules.
+import math
+from binascii import crc32
+from mlx90640 import MLX90640, RefreshRate, NUM_ROWS
+from mlx90640.calibration import read_eeprom
+from mlx90640.image import RawImage
+
+try:
+    from utime import ticks_us, ticks_diff
+except ImportError:
+    # Not on a MicroPython board; use the host's clock.
+    from time import perf_counter
+
+    def ticks_us():
+        return int(perf_counter() * 1_000_000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+## Bus frequencies tried by default, in Hz.
+BUS_FREQS = (100_000, 400_000, 1_000_000)
+## Highest bus frequency which doesn't need Fast-mode Plus, in Hz.
+FAST_MODE_MAX = 400_000
+## Refresh rate used while measuring, in Hz, so that subpages to read arrive
+#  quickly; @c tune_camera() sets the chosen rate afterward.
+MEASURE_RATE = 16
+## Longest to wait for a subpage while measuring, in microseconds.
+DATA_TIMEOUT_US = 1_000_000
+## Typical noise of the camera's pixels at a 1 Hz refresh rate, in kelvin RMS;
+#  noise grows with the square root of the refresh rate.
+NOISE_AT_1HZ = 0.1
+
+
+def subpage_noise(rate):
+    """!@brief          Estimates the pixel noise at a refresh rate.
+        @param rate     The refresh rate in Hz.
+        @return         The typical RMS noise of one pixel in kelvin.
+    """
+    return NOISE_AT_1HZ * math.sqrt(rate)
+
+
+def _set_fmplus(camera, enable):
+    # The FM+ bit is active low: 0 enables Fast-mode Plus.
+    camera.registers['fmplus_enable'] = 0 if enable else 1
+
+
+def _wait_for_data(camera, clock):
+    # Poll through the driver, as the main loop does.
+    t_start = clock()
+    while not camera.has_data:
+        if ticks_diff(clock(), t_start) > DATA_TIMEOUT_US:
+            raise OSError('No data from the camera')
+
+
+def measure_bus(make_bus, address=0x33, freqs=BUS_FREQS, reads=4, roi=None,
+                chunk_rows=NUM_ROWS, clock=ticks_us):
+    """!@brief          Measures the subpage read time at each bus frequency.
+        @details        The EEPROM is read at every frequency and compared to
+                        the read at the slowest one; a frequency is only
+                        counted as working if every read matches and no bus
+                        errors occur. Frequencies the bus doesn't support are
+                        counted as failing. Each subpage is read when the
+                        driver reports it ready, as in normal use, and only
+                        the reading is timed; the camera is left at
+                        @c MEASURE_RATE.
+        @param make_bus A function which takes a frequency in Hz and returns
+                        an I2C bus running at it, such as
+                        @c lambda freq: I2C(1, freq=freq).
+        @param address  The camera's I2C address.
+        @param freqs    The frequencies to try, in Hz, slowest first.
+        @param reads    How many subpages to read at each frequency.
+        @param roi      The region of interest which will be read, if any.
+        @param chunk_rows How many rows are read per transaction, as in
+                        @c RawImage.
+        @param clock    A function returning the time in microseconds.
+        @return         A list of (frequency, microseconds per subpage read,
+                        bytes per second of EEPROM reading) tuples, with
+                        @c None for the times of frequencies which failed.
+    """
+    results = []
+    reference = None
+    raw = RawImage(chunk_rows)
+    for freq in freqs:
+        try:
+            camera = MLX90640(make_bus(freq), address)
+            camera.setup(raw=raw, bad_pixels=False)
+            camera.roi = roi
+            _set_fmplus(camera, freq > FAST_MODE_MAX)
+            camera.refresh_rate = MEASURE_RATE
+
+            t_start = clock()
+            ee_data = read_eeprom(camera.iface)
+            ee_us = ticks_diff(clock(), t_start)
+            check = crc32(ee_data)
+            if reference is None:
+                reference = check
+            if check != reference:
+                raise OSError('EEPROM read back wrong')
+
+            read_us = 0
+            for n in range(reads):
+                _wait_for_data(camera, clock)
+                t_start = clock()
+                camera.start_read()
+                camera.read_rows(NUM_ROWS)
+                camera.finish_read()
+                read_us += ticks_diff(clock(), t_start)
+            read_us /= reads
+            results.append((freq, read_us, len(ee_data) * 1e6 / max(ee_us, 1)))
+        except (OSError, ValueError):
+            # A bus error, or a frequency the bus can't run at
+            results.append((freq, None, None))
+    return results
+
+
+def choose_rate(read_us, latency_ms, noise_budget=None):
+    """!@brief          Picks the refresh rate for a subpage read time.
+        @details        The worst case age of a subpage when it has been read
+                        is one refresh period plus the read time. The
+                        slowest, and so quietest, rate which keeps within the
+                        latency budget is chosen; the read must also finish
+                        within one period so no subpage is missed. If no rate
+                        meets the budget, the fastest one the bus can keep up
+                        with is chosen.
+        @param read_us  The time to read one subpage in microseconds.
+        @param latency_ms The latency budget in milliseconds.
+        @param noise_budget The most pixel noise allowed in kelvin RMS, or
+                        @c None for no limit.
+        @return         The chosen refresh rate in Hz, or @c None if the bus
+                        is too slow even for the slowest rate.
+    """
+    keep_up = None
+    for value in RefreshRate.values:
+        rate = RefreshRate.get_freq(value)
+        period_us = 1e6 / rate
+        if read_us > period_us:
+            break
+        if noise_budget is not None and subpage_noise(rate) > noise_budget:
+            break
+        keep_up = rate
+        if period_us + read_us <= latency_ms * 1000:
+            return rate
+    return keep_up
+
+
+def tune_camera(make_bus, address=0x33, latency_ms=600, noise_budget=None,
+                freqs=BUS_FREQS, roi=None, clock=ticks_us, verbose=True):
+    """!@brief          Chooses and sets the bus frequency and refresh rate.
+        @param make_bus A function which takes a frequency in Hz and returns
+                        an I2C bus running at it.
+        @param address  The camera's I2C address.
+        @param latency_ms The longest a subpage may take from the start of its
+                        measurement until it has been read, in milliseconds.
+        @param noise_budget The most pixel noise allowed in kelvin RMS, or
+                        @c None for no limit.
+        @param freqs    The bus frequencies to try, in Hz, slowest first.
+        @param roi      The region of interest which will be read, if any.
+        @param clock    A function returning the time in microseconds.
+        @param verbose  Whether to print the measurements and the choice.
+        @return         A tuple of the bus at the chosen frequency, the
+                        frequency in Hz, the refresh rate in Hz, and the list
+                        of measurements from @c measure_bus().
+    """
+    results = measure_bus(make_bus, address, freqs, roi=roi, clock=clock)
+    working = [result for result in results if result[1] is not None]
+    if not working:
+        raise OSError('The camera could not be read at any bus frequency')
+    freq, read_us, _ = min(working, key=lambda result: result[1])
+    rate = choose_rate(read_us, latency_ms, noise_budget)
+    if rate is None:
+        rate = RefreshRate.get_freq(RefreshRate.values[0])
+
+    bus = make_bus(freq)
+    camera = MLX90640(bus, address)
+    _set_fmplus(camera, freq > FAST_MODE_MAX)
+    camera.refresh_rate = rate
+
+    if verbose:
+        for result_freq, result_us, ee_rate in results:
+            if result_us is None:
+                print(f'{result_freq // 1000} kHz: failed')
+            else:
+                print(f'{result_freq // 1000} kHz: {result_us / 1000:.1f} ms '
+                      f'per subpage, {ee_rate / 1000:.1f} kB/s')
+        print(f'Using {freq // 1000} kHz at {rate} Hz: up to '
+              f'{(1e6 / rate + read_us) / 1000:.0f} ms latency, '
+              f'{subpage_noise(rate):.2f} K noise')
+    return bus, freq, rate, results
+
+
+if __name__ == "__main__":
+    from machine import I2C
+
+    tune_camera(lambda freq: I2C(1, freq=freq))
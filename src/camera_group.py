@@ -0,0 +1,175 @@
+"""!@file camera_group.py
+@brief      Drives several MLX90640 cameras as one wide camera.
+@details    Contains the @c CameraGroup class, which takes images from several
+            cameras at once and stitches them side by side into one panorama
+            image. The cameras can be at different addresses on one I2C bus
+            or on different buses. Each camera measures on its own, so their
+            integration periods overlap; the group only interleaves the reads,
+            stepping every camera's acquisition in turn, so no camera's data
+            goes stale while another is being read.
+
+            The panorama is an @c array('h') in the same mirrored layout as a
+            single camera's raw image, just wider, so the kernels in
+            @c targeting.py search it in one pass.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+# Import necessary modules.
+from array import array
+from mlx90640 import detect_cameras
+from mlx_cam import MLX_Cam
+from targeting import make_accumulator, hot_column, locate
+
+
+class CameraGroup:
+    """!@brief      Takes images from several cameras and stitches them.
+    """
+
+    def __init__(self, cameras, overlap=0):
+        """!@brief          Sets up a group of cameras.
+            @param cameras  @c MLX_Cam objects set up for raw images, ordered
+                            from the leftmost camera's view to the rightmost.
+            @param overlap  How many columns of each camera's view are also
+                            seen by the camera to its left; they are left out
+                            of the panorama.
+        """
+        ## The cameras, from left to right.
+        self.cameras = tuple(cameras)
+        ## Columns dropped from the left of every camera but the first.
+        self.overlap = overlap
+        ## Width of one camera's image in pixels.
+        self.cam_width = self.cameras[0].width
+        ## Height of the images in pixels.
+        self.height = self.cameras[0].height
+        ## Width of the panorama in pixels.
+        self.width = (len(self.cameras) * self.cam_width
+                      - (len(self.cameras) - 1) * overlap)
+        ## The stitched image, mirrored like a single camera's raw image.
+        self.pix = array('h', [0] * (self.width * self.height))
+        self._acc = make_accumulator(self.width, 'l', self.height)
+        # No camera has been started, so none has an image in progress.
+        self._done = [True] * len(self.cameras)
+
+    @classmethod
+    def detect(cls, *buses, overlap=0, addresses=None, **kwargs):
+        """!@brief          Finds the cameras on some I2C buses and groups them.
+            @details        Cameras are ordered by bus, then by address; put the
+                            buses and addresses in left to right order.
+            @param buses    The I2C buses to search.
+            @param overlap  See @c __init__().
+            @param addresses Only use cameras at these addresses, if given.
+            @param kwargs   Other arguments for each @c MLX_Cam.
+            @return         A new @c CameraGroup.
+        """
+        found = detect_cameras(*buses, addresses=addresses)
+        return cls([MLX_Cam(cam.iface.i2c, cam.iface.addr, **kwargs)
+                    for cam in found], overlap)
+
+    def start_image(self):
+        """!@brief          Begins taking an image with every camera.
+        """
+        for n, camera in enumerate(self.cameras):
+            camera.start_image()
+            self._done[n] = False
+
+    def step_image(self):
+        """!@brief          Advances every camera's acquisition by one step.
+            @details        When every camera has finished its image, the
+                            panorama is stitched.
+            @return         @c True if this step completed the panorama.
+        """
+        if all(self._done):
+            return False
+        for n, camera in enumerate(self.cameras):
+            if not self._done[n] and camera.step_image():
+                self._done[n] = True
+        if all(self._done):
+            self.stitch()
+            return True
+        return False
+
+    @property
+    def busy(self):
+        """!@brief          Whether a panorama is being taken.
+        """
+        return not all(self._done)
+
+    def get_image(self):
+        """!@brief          Takes a panorama, waiting until it is done.
+            @return         The panorama's pixels.
+        """
+        self.start_image()
+        while not self.step_image():
+            pass
+        return self.pix
+
+    def stitch(self):
+        """!@brief          Copies the cameras' latest images into the panorama.
+            @details        Each camera's foreground is used if it learns a
+                            background, otherwise its raw image.
+        """
+        cam_width = self.cam_width
+        pano = memoryview(self.pix)
+        # In memory the leftmost camera's view is at the right of each row.
+        right = self.width
+        for n, camera in enumerate(self.cameras):
+            pix = camera.foreground
+            if pix is None:
+                pix = camera.image.pix
+            src = memoryview(pix)
+            # Overlapping columns are on the left of the view, so the right
+            # of memory.
+            width = cam_width - (self.overlap if n else 0)
+            left = right - width
+            for row in range(self.height):
+                start = row * cam_width
+                pano[row * self.width + left:row * self.width + right] = \
+                    src[start:start + width]
+            right = left
+
+    def get_hot_column(self, even_bias=175, odd_bias=0):
+        """!@brief          Finds the hottest column of the panorama.
+            @details        See @c MLX_Cam.get_hot_column().
+            @return         The hottest column, counting from the left of the
+                            leftmost camera.
+        """
+        return hot_column(self.pix, self._acc, self.width, self.height // 2,
+                          even_bias, odd_bias, len(MLX_Cam.asc))
+
+    def locate_target(self):
+        """!@brief          Finds where the target is in the panorama.
+            @details        See @c MLX_Cam.locate_target().
+            @return         A tuple of the row and column of the target, with
+                            columns counted from the left of the leftmost
+                            camera, and a confidence from 0 to 1.
+        """
+        return locate(self.pix, self._acc, self.width, self.height,
+                      self.height // 2)
+
+    def camera_column(self, column):
+        """!@brief          Works out which camera sees a panorama column.
+            @param column   A column of the panorama, possibly fractional.
+            @return         A tuple of the camera's index and the column in
+                            that camera's image.
+        """
+        if column < self.cam_width:
+            return 0, column
+        step = self.cam_width - self.overlap
+        n = min(int((column - self.overlap) // step), len(self.cameras) - 1)
+        return n, column - n * step
+
+
+if __name__ == "__main__":
+    from machine import I2C
+
+    group = CameraGroup.detect(I2C(1))
+    print(f'{len(group.cameras)} cameras, panorama {group.width} pixels wide')
+    while True:
+        group.get_image()
+        row, column, confidence = group.locate_target()
+        print(f'Target at row {row:.1f}, column {column:.1f} '
+              f'(camera {group.camera_column(column)[0]}), '
+              f'confidence {confidence:.2f}')
@@ -13,7 +13,8 @@
 
 # Import necessary modules.
 from motor_driver import MotorDriver
-from encoder_reader import encoder
+from encoder_reader import encoder, RAD_PER_TICK
+from array import array
 import utime, pyb, math
 
 class CLController:
@@ -96,9 +97,11 @@ if __name__ == "__main__":
     
     # Use the controller to set the motor's duty cycle to try and reach the setpoint
     # over 5 seconds.
+    reading = array('l', [0, 0])
     for idx in range(500):
-        my_encoder.read_encoder()
-        my_motor.set_duty_cycle(my_controller.run(my_encoder.read_Posrad(),my_encoder.read_Velrad()))
+        my_encoder.snapshot(reading)
+        my_motor.set_duty_cycle(my_controller.run(reading[0]*RAD_PER_TICK,
+                                                  reading[1]*RAD_PER_TICK))
         utime.sleep_ms(10)
     print('done')
     
@@ -11,6 +11,15 @@
 
 # Import necessary modules.
 import time, pyb, math
+from array import array
+
+## Timer count change beyond which the timer is taken to have wrapped around,
+#  half of its 16 bit range.
+OVERFLOW = 0x8000
+## Number of counts in the timer's range.
+TIMER_RANGE = 0x10000
+## Radians turned per encoder tick, for 256 lines read in quadrature.
+RAD_PER_TICK = 2*math.pi/(256*4)
 
 class encoder:
     """!@brief      Implements an encoder class to be used in lab.
@@ -18,7 +27,7 @@ class encoder:
                     kits. Allows for functions such as reading and zeroing.
     """
     
-    def __init__(self, pin1, pin2, timer):
+    def __init__(self, pin1, pin2, timer, window=5):
         """!@brief          Initializes an encoder object.
             @details        Using pin objects as inputs, is able to create an encoder
                             capable of sensing positional changes through the use of
@@ -26,6 +35,9 @@ class encoder:
             @param pin1     Pin object connected to encoder channel A. 
             @param pin2     Pin object connected to encoder channel B.
             @param timer    Timer channel (has to be compatible with pins 1 and 2)
+            @param window   How many recent readings the velocity is
+                            calculated over; velocity is the change from the
+                            oldest to the newest.
         """
         ## Pin object representing the connection to channel A of the encoder.
         self.pin1 = pyb.Pin(pin1, pyb.Pin.OUT_PP)
@@ -42,12 +54,17 @@ class encoder:
         ## The previous timer count value.
         self.prev = 0
         
-        # Time and position lists for velocity calculation.
-        self._timelist = [0]*5
-        self._poslist = [0]*5
+        # Circular buffers of recent readings for velocity calculation, written
+        # in place so that reading the encoder allocates no memory.
+        self._timebuf = array('l', [0]*window)
+        self._posbuf = array('l', [0]*window)
+        # Index of the oldest reading, which is overwritten next.
+        self._head = 0
         
-    def read_encoder(self):
+    def read_encoder(self, now=None):
         """!@brief          Retrieves the overall position of the encoder.
+            @param now      The time of the reading from @c time.ticks_us(), if
+                            it has already been read; by default it is read here.
             @return         The total position of the encoder in ticks.
         """
         ## The current timer count value.
@@ -55,56 +72,111 @@ class encoder:
         ## The change in timer count value from the last update.
         self.delta = self.current-self.prev
         # Check for overflow/underflow
-        if abs(self.delta) > (0xFFFF+1)/2:
-            if self.delta > 0:
-                self.count -= self.delta - 0xFFFF
-            else:
-                self.count -= self.delta + 0xFFFF
-        else:
-            self.count -= self.delta
+        if self.delta > OVERFLOW:
+            self.delta -= TIMER_RANGE
+        elif self.delta < -OVERFLOW:
+            self.delta += TIMER_RANGE
+        self.count -= self.delta
         
-        # Append the position and time lists as necessary.
-        self._poslist.pop(0)
-        self._poslist.append(self.count)
-        self._timelist.pop(0)
-        self._timelist.append(time.ticks_us())
+        # Overwrite the oldest reading in the velocity window.
+        head = self._head
+        self._posbuf[head] = self.count
+        self._timebuf[head] = time.ticks_us() if now is None else now
+        head += 1
+        self._head = 0 if head == len(self._posbuf) else head
         
         self.prev = self.current
         return self.count
         
+    def snapshot(self, out, now=None):
+        """!@brief          Reads the encoder once and gives its position and
+                            velocity from that one reading.
+            @details        Calling @c read_encoder() then @c read_Posrad(),
+                            which reads the encoder again, puts two readings
+                            taken almost together into the velocity window; this
+                            adds just one. To read several encoders with a
+                            single read of the clock, pass each the same time.
+                            The results are integers written into @c out, so
+                            nothing is allocated; multiply them by
+                            @c RAD_PER_TICK for radians.
+            @param out      A buffer such as @c array('l', [0, 0]) which gets
+                            the position in ticks and the velocity in ticks/s.
+            @param now      The time of the reading from @c time.ticks_us(), if
+                            it has already been read; by default it is read here.
+            @return         The buffer @c out.
+        """
+        out[0] = self.read_encoder(now)
+        out[1] = self.read_omega()
+        return out
+    
     def read_Posrad(self):
         """!@brief          Retrieves the overall position of the encoder in radians.
             @return         The total position of the encoder in radians.
         """
-        return self.read_encoder()*2*math.pi/(256*4)
+        return self.read_encoder()*RAD_PER_TICK
     
     def read_omega(self):
         """!@brief          Retrieves the rotational velocity of the encoder.
-            @return         The rotational velocity of the encoder in ticks/second.
+            @return         The rotational velocity of the encoder in ticks/second,
+                            rounded down to a whole number so that no float
+                            is allocated.
         """
-        omega = (self._poslist[0]-self._poslist[4])/(time.ticks_diff(self._timelist[0], self._timelist[4])/1000000)
+        # The oldest reading is at the head and the newest just before it.
+        oldest = self._head
+        newest = oldest - 1
+        dt = time.ticks_diff(self._timebuf[newest], self._timebuf[oldest])
+        if dt == 0:
+            return 0
+        omega = (self._posbuf[newest]-self._posbuf[oldest])*1000000//dt
         return omega
     
     def read_Velrad(self):
         """!@brief		Retrieves the rotational velocity of the encoder in radians/s.
             @return     The rotational velocity of the encoder in r/s.
         """
-        return self.read_omega()*2*math.pi/(256*4)
+        return self.read_omega()*RAD_PER_TICK
     
     def zero(self):
         """!@brief          Sets the encoder's overall position value back to zero.
         """
         self.count = 0
         self.prev = self.timer.counter()
+        # Forget readings from before zeroing so they don't look like motion;
+        # the window starts again from this position, now.
+        now = time.ticks_us()
+        for idx in range(len(self._posbuf)):
+            self._posbuf[idx] = 0
+            self._timebuf[idx] = now
+        self._head = 0
         
 if __name__ == "__main__":
     #Set up an encoder, have it read 9 times and zero on the tenth.
     #my_encoder = encoder(pyb.Pin.board.PB6, pyb.Pin.board.PB7, 4)
     my_encoder = encoder(pyb.Pin.board.PC6, pyb.Pin.board.PC7, 8)
     my_encoder.zero()
+    # Check that none of the methods the control loop calls allocate memory,
+    # which would make the garbage collector run more often in the loop.
+    import gc
+    reading = array('l', [0, 0])
+    gc.collect()
+    mem_start = gc.mem_alloc()
+    for n in range(1000):
+        my_encoder.read_encoder()
+    print(f'{gc.mem_alloc() - mem_start} bytes allocated by 1000 reads')
+    gc.collect()
+    mem_start = gc.mem_alloc()
+    for n in range(1000):
+        my_encoder.read_omega()
+    print(f'{gc.mem_alloc() - mem_start} bytes allocated by 1000 velocity reads')
+    gc.collect()
+    mem_start = gc.mem_alloc()
+    for n in range(1000):
+        my_encoder.snapshot(reading)
+    print(f'{gc.mem_alloc() - mem_start} bytes allocated by 1000 snapshots')
     while True:
         for n in range(100):
             my_encoder.read_encoder()
         if n == 99:
-            print(f'pos:{my_encoder.read_Posrad()}, vel:{my_encoder.read_Velrad()}')
+            my_encoder.snapshot(reading)
+            print(f'pos:{reading[0]*RAD_PER_TICK}, vel:{reading[1]*RAD_PER_TICK}')
         time.sleep(0.010)
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""!@file frame_log.py
+@brief      Append-only binary log of raw camera frames.
+@details    Each record is a fixed size header followed by the frame's pixels,
+            so a log can be appended to indefinitely and read on a host as an
+            array of records without parsing (see @c tools/frame_log_reader.py).
+
+            Record layout, all little-endian:
+
+            | Offset | Type       | Field                                  |
+            |--------|------------|----------------------------------------|
+            | 0      | char[4]    | magic, @c b'MLXF'                       |
+            | 4      | uint32     | frame sequence number                   |
+            | 8      | uint32     | @c ticks_us() when the read started     |
+            | 12     | uint8      | subpage id of the last subpage read     |
+            | 13     | uint8      | read pattern id                         |
+            | 14     | uint16     | number of pixels that follow            |
+            | 16     | int32      | yaw encoder position in ticks           |
+            | 20     | int32      | pitch encoder position in ticks         |
+            | 24     | int16[768] | raw pixels, row by row                  |
+
+            The header and pixels are written straight from preallocated
+            buffers, so logging a frame allocates no memory. Any stream with
+            a @c write() method can be used, such as a file on flash or
+            @c pyb.USB_VCP().
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+# Import necessary modules.
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+## Magic bytes at the start of every record.
+RECORD_MAGIC = b'MLXF'
+## Header layout, see the table above.
+HEADER_FORMAT = '<4sIIBBHii'
+## Size of a record header in bytes.
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+## Number of pixels in a frame.
+FRAME_PIXELS = 768
+## Size of a whole record in bytes.
+RECORD_SIZE = HEADER_SIZE + 2 * FRAME_PIXELS
+
+
+class FrameLog:
+    """!@brief      Writes raw camera frames to a stream as binary records.
+    """
+
+    def __init__(self, stream, flush_every=0):
+        """!@brief          Sets up a frame log on an open stream.
+            @param stream   A binary stream with a @c write() method, such as a
+                            file opened with mode @c 'ab'.
+            @param flush_every Flush the stream after this many records, or
+                            never if 0.
+        """
+        ## The stream records are written to.
+        self.stream = stream
+        ## How many records to write between flushes.
+        self.flush_every = flush_every
+        ## Number of records written so far.
+        self.count = 0
+        self._header = bytearray(HEADER_SIZE)
+
+    def write(self, raw, yaw=0, pitch=0):
+        """!@brief          Appends a frame to the log.
+            @details        The pixels must be an @c array('h') in the board's
+                            native byte order, which is little-endian on the
+                            STM32.
+            @param raw      A @c RawImage, e.g. @c MLX_Cam.get_frame().
+            @param yaw      The yaw encoder position in ticks.
+            @param pitch    The pitch encoder position in ticks.
+        """
+        struct.pack_into(HEADER_FORMAT, self._header, 0, RECORD_MAGIC,
+                         raw.seq & 0xFFFFFFFF, raw.ticks & 0xFFFFFFFF,
+                         raw.sp_id or 0, raw.pattern_id or 0, len(raw.pix),
+                         yaw, pitch)
+        self.stream.write(self._header)
+        self.stream.write(raw.pix)
+        self.count += 1
+        if self.flush_every and self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        """!@brief          Flushes the stream, if it can be flushed.
+        """
+        flush = getattr(self.stream, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def close(self):
+        """!@brief          Flushes and closes the stream.
+        """
+        self.flush()
+        self.stream.close()
+
+
+def open_log(path, flush_every=16):
+    """!@brief          Opens a log file on flash for appending.
+        @param path     The log file's path.
+        @param flush_every Flush the file after this many records.
+        @return         A @c FrameLog writing to the file.
+    """
+    return FrameLog(open(path, 'ab'), flush_every)
+
+
+if __name__ == "__main__":
+    # Log a few frames from the camera to flash.
+    from machine import I2C
+    from mlx_cam import MLX_Cam
+
+    camera = MLX_Cam(I2C(1))
+    log = open_log('frames.bin')
+    for n in range(10):
+        camera.get_image()
+        log.write(camera.get_frame())
+        print(f'Logged frame {log.count}')
+    log.close()
@@ -0,0 +1,253 @@
+"""!@file frame_stream.py
+@brief      Streams raw camera frames to a host as compact binary packets.
+@details    Meant for watching the camera remotely over @c pyb.USB_VCP, where
+            CSV text from @c MLX_Cam.get_csv() is several times larger and
+            slow to format. Each packet is a fixed size header, a payload and
+            a CRC, all little-endian:
+
+            | Offset | Type      | Field                                    |
+            |--------|-----------|------------------------------------------|
+            | 0      | char[4]   | magic, @c b'MLXS'                        |
+            | 4      | uint8     | encoding, see below                      |
+            | 5      | uint8     | subpage id of the last subpage read      |
+            | 6      | uint8     | read pattern id                          |
+            | 7      | uint8     | packet number, modulo 256                |
+            | 8      | uint32    | frame sequence number                    |
+            | 12     | uint32    | @c ticks_us() when the read started      |
+            | 16     | uint16    | number of pixels in the frame            |
+            | 18     | uint16    | payload length in bytes                  |
+            | 20     | bytes     | payload                                  |
+            | 20 + n | uint32    | CRC-32 of the header and payload         |
+
+            With @c ENCODING_RAW the payload is the frame's int16 pixels, row
+            by row. With @c ENCODING_DELTA it is a list of varint tokens
+            (7 bits per byte, least significant first, high bit set on all
+            but the last byte) which rebuild the frame from the previous one:
+            a token with its low bit clear is one pixel whose change, zigzag
+            encoded, is the rest of the token; a token with its low bit set is
+            a run of unchanged pixels whose length is the rest of the token.
+            As each subpage changes only half the pixels and most of those
+            change little, delta packets are usually a third the size of raw
+            ones or less.
+
+            A raw packet is sent first, every @c key_every packets, and
+            whenever a delta packet wouldn't be smaller, so a host which
+            misses a packet can pick up again; it can tell one is missing
+            from the packet number. Frames may be skipped freely, as each
+            delta packet is against the last frame sent. The host decoder is
+            @c tools/frame_stream_decoder.py.
+
+            If the board supports MicroPython's viper code emitter, the delta
+            encoder in @c frame_stream_viper.py is used; otherwise the pure
+            Python one below is used, which gives identical results.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+# Import necessary modules.
+from array import array
+from binascii import crc32
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+try:
+    from frame_stream_viper import encode_delta as encode_delta_viper
+except (ImportError, SyntaxError, NameError):
+    # No viper code emitter on this port (or not running MicroPython at all).
+    encode_delta_viper = None
+
+## Magic bytes at the start of every packet.
+PACKET_MAGIC = b'MLXS'
+## Header layout, see the table above.
+HEADER_FORMAT = '<4sBBBBIIHH'
+## Size of a packet header in bytes.
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+## Size of the CRC after the payload in bytes.
+CRC_SIZE = 4
+## Payload encoding: the frame's pixels as they are.
+ENCODING_RAW = 0
+## Payload encoding: changes from the previous frame, as varint tokens.
+ENCODING_DELTA = 1
+## Longest a delta token can be in bytes; a change of a 16 bit pixel needs
+#  19 bits once zigzag encoded and tagged.
+MAX_TOKEN_SIZE = 3
+
+
+def encode_delta(pix, prev, out, start, count):
+    """!@brief          Encodes the changes between two frames as tokens.
+        @details        Pure Python version of the kernel. @c prev is updated
+                        to match @c pix as it goes.
+        @param pix      The new frame's pixels, an @c array('h').
+        @param prev     The previous frame's pixels, an @c array('h').
+        @param out      A @c bytearray for the tokens, with room for
+                        @c MAX_TOKEN_SIZE bytes per pixel after @c start.
+        @param start    Where in @c out to put the first token.
+        @param count    The number of pixels.
+        @return         The position in @c out just after the last token.
+    """
+    pos = start
+    run = 0
+    for idx in range(count):
+        val = pix[idx]
+        diff = val - prev[idx]
+        if not diff:
+            run += 1
+            continue
+        prev[idx] = val
+        if run:
+            token = (run << 1) | 1
+            run = 0
+            while token > 0x7F:
+                out[pos] = (token & 0x7F) | 0x80
+                pos += 1
+                token >>= 7
+            out[pos] = token
+            pos += 1
+        # Zigzag encode, then leave the low bit clear
+        token = diff << 2 if diff > 0 else (-diff << 2) - 2
+        while token > 0x7F:
+            out[pos] = (token & 0x7F) | 0x80
+            pos += 1
+            token >>= 7
+        out[pos] = token
+        pos += 1
+    if run:
+        token = (run << 1) | 1
+        while token > 0x7F:
+            out[pos] = (token & 0x7F) | 0x80
+            pos += 1
+            token >>= 7
+        out[pos] = token
+        pos += 1
+    return pos
+
+
+class FrameStream:
+    """!@brief      Sends raw camera frames to a stream as binary packets.
+    """
+
+    def __init__(self, stream, pixels=768, key_every=32, delta=True):
+        """!@brief          Sets up a frame stream.
+            @param stream   A binary stream with a @c write() method, such as
+                            @c pyb.USB_VCP(); see @c open_usb().
+            @param pixels   The number of pixels in each frame.
+            @param key_every Send a raw packet at least this often.
+            @param delta    Whether to send delta packets at all.
+        """
+        ## The stream packets are written to.
+        self.stream = stream
+        ## How many packets may go by between raw packets.
+        self.key_every = key_every
+        ## Whether delta packets are sent.
+        self.delta = delta
+        ## Number of packets sent so far.
+        self.count = 0
+        ## Number of payload bytes sent so far.
+        self.payload_bytes = 0
+        self._since_key = 0
+        # The last frame sent, which delta packets are encoded against
+        self._prev = array('h', [0] * pixels)
+        # Room for the longest payload plus a header in front of it
+        self._packet = bytearray(HEADER_SIZE + MAX_TOKEN_SIZE * pixels)
+        self._packet_view = memoryview(self._packet)
+        self._crc = bytearray(CRC_SIZE)
+
+    def send(self, raw):
+        """!@brief          Sends a frame.
+            @details        Frames are skipped if the stream says nothing is
+                            listening, so the caller isn't held up.
+            @param raw      A @c RawImage, e.g. @c MLX_Cam.get_frame().
+            @return         @c True if the frame was sent.
+        """
+        connected = getattr(self.stream, 'isconnected', None)
+        if connected is not None and not connected():
+            # Start again from a raw packet when someone listens
+            self._since_key = 0
+            return False
+
+        pix = raw.pix
+        count = len(pix)
+        packet = self._packet_view
+        length = 0
+        encoding = ENCODING_RAW
+        if self.delta and self._since_key:
+            if encode_delta_viper is not None:
+                end = encode_delta_viper(pix, self._prev, self._packet,
+                                         HEADER_SIZE, count)
+            else:
+                end = encode_delta(pix, self._prev, self._packet,
+                                   HEADER_SIZE, count)
+            length = end - HEADER_SIZE
+            if length < 2 * count:
+                encoding = ENCODING_DELTA
+        if encoding == ENCODING_RAW:
+            length = 2 * count
+            self._prev[:] = pix
+            self._since_key = 0
+
+        struct.pack_into(HEADER_FORMAT, self._packet, 0, PACKET_MAGIC,
+                         encoding, raw.sp_id or 0, raw.pattern_id or 0,
+                         self.count & 0xFF, raw.seq & 0xFFFFFFFF, raw.ticks & 0xFFFFFFFF,
+                         count, length)
+        if encoding == ENCODING_RAW:
+            crc = crc32(pix, crc32(packet[:HEADER_SIZE]))
+            self.stream.write(packet[:HEADER_SIZE])
+            self.stream.write(pix)
+        else:
+            crc = crc32(packet[:HEADER_SIZE + length])
+            self.stream.write(packet[:HEADER_SIZE + length])
+        struct.pack_into('<I', self._crc, 0, crc & 0xFFFFFFFF)
+        self.stream.write(self._crc)
+
+        self.count += 1
+        self.payload_bytes += length
+        self._since_key += 1
+        if self._since_key >= self.key_every:
+            self._since_key = 0
+        return True
+
+    def close(self):
+        """!@brief          Stops streaming; Ctrl-C works on the stream again.
+        """
+        setinterrupt = getattr(self.stream, 'setinterrupt', None)
+        if setinterrupt is not None:
+            setinterrupt(3)
+
+
+def open_usb(key_every=32, delta=True):
+    """!@brief          Starts streaming frames over the USB virtual COM port.
+        @details        Ctrl-C is no longer caught on the port, as byte 3 can
+                        appear in the packets; call @c FrameStream.close() to
+                        get it back. Text printed on the port is skipped by
+                        the host decoder.
+        @param key_every See @c FrameStream.
+        @param delta    See @c FrameStream.
+        @return         A @c FrameStream writing to the port.
+    """
+    import pyb
+
+    vcp = pyb.USB_VCP()
+    vcp.setinterrupt(-1)
+    return FrameStream(vcp, key_every=key_every, delta=delta)
+
+
+if __name__ == "__main__":
+    # Stream frames from the camera as each subpage arrives.
+    from machine import I2C
+    from mlx_cam import MLX_Cam
+
+    camera = MLX_Cam(I2C(1), half_frames=True)
+    stream = open_usb()
+    try:
+        camera.start_image()
+        while True:
+            if camera.step_image():
+                stream.send(camera.get_frame())
+                camera.start_image()
+    finally:
+        stream.close()
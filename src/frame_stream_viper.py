@@ -0,0 +1,72 @@
+"""!@file frame_stream_viper.py
+@brief      Viper version of the delta encoder in frame_stream.py.
+@details    This is compiled to machine code by MicroPython's viper emitter,
+            so it only loads on boards which support it; @c frame_stream.py
+            falls back to its pure Python kernel otherwise. It must give
+            exactly the same results as its Python twin.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+import micropython
+
+
+@micropython.viper
+def encode_delta(pix: ptr16, prev: ptr16, out: ptr8, start: int,
+                 count: int) -> int:
+    """!@brief          Viper version of @c frame_stream.encode_delta().
+        @param pix      The new frame's pixels, an @c array('h').
+        @param prev     The previous frame's pixels, an @c array('h').
+        @param out      A @c bytearray for the tokens.
+        @param start    Where in @c out to put the first token.
+        @param count    The number of pixels.
+        @return         The position in @c out just after the last token.
+    """
+    pos = start
+    run = 0
+    idx = 0
+    while idx < count:
+        # ptr16 reads are unsigned, so sign-extend the pixel values.
+        val = int(pix[idx])
+        if val & 0x8000:
+            val -= 0x10000
+        old = int(prev[idx])
+        if old & 0x8000:
+            old -= 0x10000
+        diff = val - old
+        if diff == 0:
+            run += 1
+            idx += 1
+            continue
+        prev[idx] = val
+        if run:
+            token = (run << 1) | 1
+            run = 0
+            while token > 0x7F:
+                out[pos] = (token & 0x7F) | 0x80
+                pos += 1
+                token >>= 7
+            out[pos] = token
+            pos += 1
+        if diff > 0:
+            token = diff << 2
+        else:
+            token = ((0 - diff) << 2) - 2
+        while token > 0x7F:
+            out[pos] = (token & 0x7F) | 0x80
+            pos += 1
+            token >>= 7
+        out[pos] = token
+        pos += 1
+        idx += 1
+    if run:
+        token = (run << 1) | 1
+        while token > 0x7F:
+            out[pos] = (token & 0x7F) | 0x80
+            pos += 1
+            token >>= 7
+        out[pos] = token
+        pos += 1
+    return pos
@@ -7,11 +7,12 @@
             the program will start.
             
             Once started, the program takes a picture of the opposite side of the
-            table. With this data, it calculates where the opponent is, and converts
-            this into a motor angle. The program then continuously controls the motor
-            to go to this angle. Upon 5 seconds (when the opponent is no longer
-            able to move) the turret takes another picture and adjusts to this position.
-            After 0.5s of adjusting, the gun shoots and then takes another picture.
+            table. With this data, it calculates where the opponent is. Half of
+            the picture is refreshed every half second, and a tracker estimates
+            how the opponent is moving, so the yaw motor is continuously
+            controlled toward where the opponent is predicted to be now. Once 5 seconds
+            have passed (when the opponent is no longer able to move), 0.5s
+            after each picture the gun shoots and then takes another picture.
             This process of taking a picture, calculating an angle, adjusting, and
             shooting continues indefinitely. When a shot count maximum is reached,
             the gun will no longer shoot but will still adjust to point at the
@@ -28,14 +29,19 @@
 # Import necessary modules.
 import pyb
 import math
+from array import array
 from nerf import Nerf
 from controller import CLController
 from motor_driver import MotorDriver
-from encoder_reader import encoder
+from encoder_reader import encoder, RAD_PER_TICK
 from machine import Pin, I2C
 from mlx_cam import MLX_Cam
+from tracker import TargetTracker
+from cam_tuning import tune_camera
+from mlx90640.image import Roi
+from telemetry import Telemetry, USB_MAX_DRAIN
 
-from time import ticks_ms, ticks_add, ticks_diff
+from time import ticks_ms, ticks_us, ticks_add, ticks_diff
 
 def onButtonPress(IRQ_src):
     """!@brief          Detects interrupt request through blue button press.
@@ -49,6 +55,46 @@ def onButtonPress(IRQ_src):
     ## Indicates whether or not the blue button has recently been pressed.
     buttonPressed = True
 
+def aim_at_picture(camera, tracker, min_confidence, row_ref):
+    """!@brief          Takes a picture and starts tracking the target in it.
+        @details        If a picture is already being taken, it is finished
+                        rather than started over. If nothing stands out from
+                        the learned background, the hottest column of the
+                        picture is aimed at instead, at the reference row.
+        @param camera   The camera object.
+        @param tracker  The target tracker, which is reset.
+        @param min_confidence Confidence below which the target is not
+                        trusted.
+        @param row_ref  The image row to aim at if the target isn't found.
+        @return         The camera's image data.
+    """
+    if camera.busy:
+        while not camera.step_image():
+            pass
+        image = camera.image
+    else:
+        image = camera.get_image()
+    row, column, confidence = camera.locate_target(camera.foreground)
+    if confidence < min_confidence:
+        column = camera.get_hot_column(image)
+        row = row_ref
+    tracker.reset()
+    tracker.update(capture_ms(camera), column, row)
+    return image
+
+def capture_ms(camera):
+    """!@brief          Finds when the camera's latest picture was taken.
+        @details        The camera driver keeps the time at which it started
+                        reading each subpage, in microseconds; this converts
+                        that time to the @c ticks_ms() clock used by the
+                        tracker, so the tracker isn't thrown off by how long
+                        the picture took to read.
+        @param camera   The camera object.
+        @return         The time of the picture, from @c ticks_ms().
+    """
+    age_us = ticks_diff(ticks_us(), camera.get_frame().ticks)
+    return ticks_add(ticks_ms(), -(age_us // 1000))
+
 if __name__ == "__main__":
     # The main script of the program. Will set up all necessary objects and then
     # act on states as programmed. Takes care of motor reading/control, camera
@@ -79,15 +125,35 @@ if __name__ == "__main__":
     my_encoder_pitch.zero()
     ## Pitch motor's closed loop controller.
     my_controller_pitch = CLController(30, .1, 8, 0)
+    ## Buffers for each encoder's position in ticks and velocity in ticks/s,
+    #  which the encoders fill in without allocating memory.
+    yaw_reading = array('l', [0, 0])
+    pitch_reading = array('l', [0, 0])
     
     ## Nerf gun object for arming and shooting.
     my_gun = Nerf(Pin.board.PB3, Pin.board.PC4)
     
+    ## Whether telemetry from the controllers is streamed to the PC over USB
+    #  while running, for tools/telemetry_decoder.py. Ctrl-C is turned off on
+    #  the USB port while streaming, so use the blue button to stop.
+    stream_telemetry = False
+    ## Ring of the controllers' setpoints, positions, velocities and
+    #  actuations each period. If not streamed, the last few seconds are saved
+    #  to flash on exit. Blocks are kept small enough to fit in the USB
+    #  port's transmit buffer, so draining never waits for the PC.
+    telemetry = Telemetry(stream=serport if stream_telemetry else None,
+                          max_drain=USB_MAX_DRAIN)
+    if stream_telemetry:
+        serport.setinterrupt(-1)
+    
     # Set up dummy periods for the first run of the tasks.
     ## Period for the controller task in ms.
     cont_per = 10
-    ## Initial period for the camera task in ms.
-    cam_per  = 5500
+    ## Period for the camera task in ms; each run refreshes half the picture.
+    cam_per  = 500
+    ## How long the opponent may move after the start in ms; no shots are
+    #  scheduled until it has passed.
+    hold_time = 5000
     ## Inital period for the nerf gun task in ms.
     shoot_per = 4500
     
@@ -97,21 +163,65 @@ if __name__ == "__main__":
     # Oops, it's not an STM32; assume generic machine.I2C for ESP32 and others
     except ImportError:
         # For ESP32 38-pin cheapo board from NodeMCU, KeeYees, etc.
-        i2c_bus = I2C(1, scl=Pin(22), sda=Pin(21))
+        def make_bus(freq):
+            return I2C(1, scl=Pin(22), sda=Pin(21), freq=freq)
 
     # OK, we do have an STM32, so just use the default pin assignments for I2C1
     else:
-        i2c_bus = I2C(1)
+        def make_bus(freq):
+            return I2C(1, freq=freq)
 
     # Select MLX90640 camera I2C address, normally 0x33, and check the bus
     ## MLX90640's I2C address.
     i2c_address = 0x33
-    _scanhex = [f"0x{addr:X}" for addr in i2c_bus.scan()]
+    _scanhex = [f"0x{addr:X}" for addr in make_bus(100_000).scan()]
     print(f"I2C Scan: {_scanhex}")
     
-    # Create the camera object and set it up in default mode
+    ## Rows of the image in which the opponent is searched for; the rest of
+    #  the table isn't read from the camera at all.
+    roi_rows = (0, 12)
+    ## The longest a half picture may take from being measured by the camera
+    #  until it has been read, in ms.
+    cam_latency = 600
+    # Find the fastest bus speed which works reliably and the quietest camera
+    # refresh rate which meets the latency, and print what was measured.
+    ## The I2C bus to which the camera is attached, at the chosen speed.
+    i2c_bus = tune_camera(make_bus, i2c_address, cam_latency, roi=Roi(*roi_rows))[0]
+    
+    # Create the camera object and set it up in default mode, learning the
+    # static heat sources in its view so that the opponent stands out, and
+    # filling in the pixels the camera's EEPROM flags as bad
     ## The camera object for the MLX90640.
-    camera = MLX_Cam(i2c_bus)
+    camera = MLX_Cam(i2c_bus, background=True, half_frames=True, bad_pixels=True)
+    # Look for stuck pixels in the first pictures, while waiting to start
+    camera.watch_stuck_pixels()
+    camera.set_roi(roi_rows)
+    ## Columns read on either side of the target once it is being tracked.
+    roi_margin = 6
+    ## How long the background is learned for after startup, in ms. The
+    #  opponent should stay out of view until then; learning is frozen from
+    #  then until the start, so that someone standing still is not learned.
+    learn_time = 3000
+    ## The time at which the camera started learning the background.
+    t_learn = ticks_ms()
+    
+    ## Tracker which predicts where the target is between pictures.
+    tracker = TargetTracker()
+    ## Confidence below which a picture is not used to update the tracker.
+    min_confidence = 0.05
+    
+    # Mapping from the target's row in the image to a pitch angle. The scale is
+    # estimated from the yaw mapping and the camera's 55 by 35 degree field of
+    # view, and should be checked on the turret.
+    ## Whether the pitch follows the target's row. Until @c pitch_per_row has
+    #  been measured on the turret, the pitch is held at @c pitch_ref.
+    aim_pitch = False
+    ## Pitch angle which aims at row @c row_ref, in radians.
+    pitch_ref = 8
+    ## Image row which the pitch angle @c pitch_ref aims at.
+    row_ref = 6
+    ## Change of pitch angle per image row, in radians.
+    pitch_per_row = .4763
     
     # Overall states for this general file. Psuedo states are present though not
     # explicitly called out. Please see the main page.
@@ -151,13 +261,11 @@ if __name__ == "__main__":
                 t_init = ticks_ms()
                 # Go to the pseudotask running state.
                 state = s1
-                ## The camera's image data.
-                image = camera.get_image()
-                ## The hottest column of the camera's image.
-                column = camera.get_hot_column(image)
-                ## The angle at which the yaw motor should turn to in order to
-                #  aim at the target.
-                motorAngle = .5613 * column + 117.89
+                ## The camera's image data. Tracking of the target starts
+                #  from this picture.
+                image = aim_at_picture(camera, tracker, min_confidence, row_ref)
+                # From now on the opponent moves, so keep learning.
+                camera.learning = True
                 
                 # Set the next time for the pseudotasks to run. Note, for the
                 # nerf gun this is an arbitrary placeholder time that is just
@@ -187,12 +295,10 @@ if __name__ == "__main__":
                     t_init = ticks_ms()
                     # Go to the pseudotask running state.
                     state = s1
-                    # Take a picture.
-                    image = camera.get_image()
-                    # Get the hottest column.
-                    column = camera.get_hot_column(image)
-                    # Calculate where the yaw motor should turn to.
-                    motorAngle = .5613 * column + 117.89
+                    # Take a picture and start tracking the target from it.
+                    image = aim_at_picture(camera, tracker, min_confidence, row_ref)
+                    # From now on the opponent moves, so keep learning.
+                    camera.learning = True
                     
                     # Set the next time for the pseudotasks to run. Note, for the
                     # nerf gun this is an arbitrary placeholder time that is just
@@ -201,6 +307,17 @@ if __name__ == "__main__":
                     t_next_cont  = ticks_add(t_rn, cont_per)
                     t_next_cam   = ticks_add(t_init, cam_per)
                     t_next_shoot = ticks_add(t_rn, 10_000)
+            
+            # While waiting, keep taking pictures so the camera learns the
+            # background of the scene, then stop learning once the opponent
+            # may be in view.
+            elif camera.busy:
+                camera.step_image()
+            else:
+                if camera.learning and ticks_diff(ticks_ms(), t_learn) >= learn_time:
+                    camera.learning = False
+                    print('Background learned')
+                camera.start_image()
                 
         if state == s1:
             try:
@@ -214,31 +331,90 @@ if __name__ == "__main__":
                     my_motor_yaw.set_duty_cycle(0)
                     # Disarm the gun.
                     my_gun.disarm()
+                    # Keep the last few seconds of telemetry.
+                    if not stream_telemetry:
+                        telemetry.save('telemetry.bin')
                     print('Exiting')
                     # Quit the program.
                     break
                 
-                # Camera pseudotask.
-                if ticks_diff(ticks_ms(), t_next_cam) >=0:
-
-                    # Disabling the motors before taking the picture for ~500ms
-                    # to avoid issues.
-                    my_motor_yaw.set_duty_cycle(0)
-                    my_motor_pitch.set_duty_cycle(0)
+                # Controller psuedotask. This runs first so that it keeps its
+                # period while the camera reads an image in the background.
+                if ticks_diff(ticks_ms(), t_next_cont) >= 0:
+                    # Tell the task to run again in 10ms if possible.
+                    t_next_cont = ticks_add(ticks_ms(), cont_per)
+                    ## The time at which this controller period started, in us.
+                    t_cont_us = ticks_us()
                     
-                    # Get image and calculate yaw motor angle.
-                    image = camera.get_image()
-                    print('Click')
-                    column = camera.get_hot_column(image)
-                    motorAngle = .5613 * column + 117.89
+                    # Set yaw motor controls.
+                    ## The angle at which the yaw motor should turn to in order
+                    #  to aim at where the target is predicted to be now.
+                    motorAngle = .5613 * tracker.predict_col(ticks_ms()) + 117.89
+                    # Update the controller's positional set point.
+                    my_controller_yaw.set_Pos(motorAngle)
+                    # Read the yaw motor's position in radians and velocity in
+                    # radians per second, once, at the start of this period.
+                    my_encoder_yaw.snapshot(yaw_reading, t_cont_us)
+                    pos_yaw = yaw_reading[0]*RAD_PER_TICK
+                    vel_yaw = yaw_reading[1]*RAD_PER_TICK
+                    ## The duty cycle applied to the yaw motor, calculated through
+                    #  a closed loop control law.
+                    actuation_yaw = my_controller_yaw.run(pos_yaw, vel_yaw)
+                    # Apply the actuation value to the yaw motor.
+                    my_motor_yaw.set_duty_cycle(actuation_yaw)
                     
-                    # Stall next camera shot an arbitrary amount.
-                    t_next_cam = ticks_add(ticks_ms(), cam_per)
+                    # Set pitch motor controls.
+                    ## The angle at which the pitch motor should turn to in
+                    #  order to aim at the target's predicted row, if the
+                    #  pitch is aimed at all.
+                    if aim_pitch:
+                        pitchAngle = pitch_ref - pitch_per_row * (tracker.predict_row(ticks_ms()) - row_ref)
+                    else:
+                        pitchAngle = pitch_ref
+                    # Update the controller's positional set point.
+                    my_controller_pitch.set_Pos(pitchAngle)
+                    # Read the pitch motor's position and velocity the same way.
+                    my_encoder_pitch.snapshot(pitch_reading, t_cont_us)
+                    pos_pitch = pitch_reading[0]*RAD_PER_TICK
+                    vel_pitch = pitch_reading[1]*RAD_PER_TICK
+                    ## The duty cycle applied to the pitch motor, calculated through
+                    #  a closed loop control law.
+                    actuation_pitch = my_controller_pitch.run(pos_pitch, vel_pitch)
+                    # Apply the actuation value to the pitch motor.
+                    my_motor_pitch.set_duty_cycle(actuation_pitch)
                     
-                    # Tell gun to shoot in .5 seconds to allow for motor adjustment.
-                    t_next_shoot = ticks_add(ticks_ms(), 500)
+                    # Record this period for the telemetry.
+                    telemetry.record(t_cont_us, motorAngle, pos_yaw, vel_yaw, actuation_yaw,
+                                     pitchAngle, pos_pitch, vel_pitch, actuation_pitch)
+                
+                # Camera pseudotask, reading the picture a few rows at a time.
+                elif camera.busy:
                     
-                # Nerf gun psuedotask.
+                    # Once the image is complete, update the target's track.
+                    if camera.step_image():
+                        print('Click')
+                        image = camera.image
+                        row, column, confidence = camera.locate_target(camera.foreground)
+                        # Ignore pictures where nothing stands out, and look
+                        # at the whole width again in case the target was lost.
+                        if confidence >= min_confidence:
+                            tracker.update(capture_ms(camera), column, row)
+                            # Read only around where the target will be when
+                            # the next picture is taken.
+                            camera.follow_target(tracker.predict_col(ticks_add(ticks_ms(), cam_per)), roi_margin, roi_rows)
+                        else:
+                            camera.set_roi(roi_rows)
+                        
+                        # Take the next picture one period from now.
+                        t_next_cam = ticks_add(ticks_ms(), cam_per)
+                        
+                        # Once the opponent has stopped moving, tell gun to
+                        # shoot in .5 seconds to allow for motor adjustment.
+                        if ticks_diff(ticks_ms(), t_init) >= hold_time:
+                            t_next_shoot = ticks_add(ticks_ms(), 500)
+                
+                # Nerf gun psuedotask. This comes before starting a picture,
+                # as each picture is scheduled to start when the shot is due.
                 elif ticks_diff(ticks_ms(), t_next_shoot) >= 0:
                     
                     # Shoot the nerf gun if less than 2 shots have been taken.
@@ -255,35 +431,21 @@ if __name__ == "__main__":
                         # Increment the counter so that this block only runs once.
                         shot_count += 1
                     
-                    # Tell camera to take another picture now.
+                    # Tell camera to take another picture now, and wait for
+                    # it before the next shot is scheduled.
                     t_next_cam = ticks_ms()
+                    t_next_shoot = ticks_add(ticks_ms(), 10_000)
+                
+                # Camera pseudotask, starting a new picture. The motors keep
+                # running while the picture is taken.
+                elif ticks_diff(ticks_ms(), t_next_cam) >=0:
+                    camera.start_image()
                     
-                 
-                # Controller psuedotask.
-                elif ticks_diff(ticks_ms(), t_next_cont) >= 0:
-                    # Tell the task to run again in 10ms if possible.
-                    t_next_cont = ticks_add(ticks_ms(), cont_per)
-                    
-                    # Set yaw motor controls.
-                    # Update the yaw motor.
-                    my_encoder_yaw.read_encoder()
-                    # Update the controller's positional set point.
-                    my_controller_yaw.set_Pos(motorAngle)
-                    ## The duty cycle applied to the yaw motor, calculated through
-                    #  a closed loop control law.
-                    actuation_yaw = my_controller_yaw.run(my_encoder_yaw.read_Posrad(), my_encoder_yaw.read_Velrad())
-                    # Apply the actuation value to the yaw motor.
-                    my_motor_yaw.set_duty_cycle(actuation_yaw)
-                    
-                    # Set pitch motor controls. Note, the pitch motor is kept at
-                    # constant angle.
-                    # Update the pitch motor.
-                    my_encoder_pitch.read_encoder()
-                    ## The duty cycle applied to the pitch motor, calculated through
-                    #  a closed loop control law.
-                    actuation_pitch = my_controller_pitch.run(my_encoder_pitch.read_Posrad(), my_encoder_pitch.read_Velrad())
-                    # Apply the actuation value to the pitch motor.
-                    my_motor_pitch.set_duty_cycle(actuation_pitch)
+                # Telemetry psuedotask, sending a few records to the PC when
+                # nothing else needs to run. Nothing is sent unless the PC
+                # is connected and has read the last block.
+                elif stream_telemetry and len(telemetry):
+                    telemetry.drain()
                 
             except KeyboardInterrupt:
                 # If Ctrl+C is entered, disable the motors.
@@ -291,7 +453,12 @@ if __name__ == "__main__":
                 my_motor_yaw.set_duty_cycle(0)
                 # Disarm the gun.
                 my_gun.disarm()
+                # Keep the last few seconds of telemetry.
+                if not stream_telemetry:
+                    telemetry.save('telemetry.bin')
                 print('Exiting')
                 # Exit the program.
                 break
-
+    
+    # Give Ctrl-C back to the USB port in case telemetry was streamed.
+    serport.setinterrupt(3)
@@ -3,14 +3,16 @@
 This file contains a class which controls an MLX90640 thermal infrared camera.
 
 RAW VERSION
-This version is a stripped down MLX90640 driver which produces only raw data,
-not calibrated data, in order to save memory.
+This version is a stripped down MLX90640 driver which produces raw data by
+default in order to save memory; calibrated data is only set up when
+MLX90640.setup() is asked for it.
 """
 
-from gc import collect, mem_free
-from ucollections import namedtuple
+from gc import collect
+from mlx90640.utils import namedtuple, ticks_us, ticks_diff, mem_free
 from mlx90640.regmap import (
     REGISTER_MAP,
+    VOLATILE_REGISTERS,
     EEPROM_MAP,
     RegisterMap,
     CameraInterface,
@@ -18,8 +20,23 @@ from mlx90640.regmap import (
     EEPROM_ADDRESS,
     EEPROM_SIZE,
 )
-# from mlx90640.calibration import CameraCalibration, TEMP_K
-from mlx90640.image import RawImage, Subpage, get_pattern_by_id
+from mlx90640.calibration import (
+    CameraCalibration,
+    read_eeprom,
+    read_bad_pixels,
+    TEMP_K,
+    NUM_ROWS,
+    NUM_COLS,
+)
+from mlx90640.image import (
+    RawImage,
+    FrameRing,
+    ProcessedImage,
+    BadPixelMap,
+    Roi,
+    Subpage,
+    get_pattern_by_id,
+)
 
 
 class CameraDetectError(Exception):
@@ -41,6 +58,29 @@ def detect_camera(i2c):
     return MLX90640(i2c, cam_addr)
 
 
+def detect_cameras(*buses, addresses=None):
+    """ Detect every camera on one or more I2C interfaces. A device counts as
+    a camera if its I2C address register holds its own address.
+    @param addresses Only look at these addresses, if given
+    @returns A list of new MLX90640 objects, in bus and address order
+    """
+    cameras = []
+    for i2c in buses:
+        for addr in sorted(i2c.scan()):
+            if addresses is not None and addr not in addresses:
+                continue
+            camera = MLX90640(i2c, addr)
+            try:
+                if camera.registers['i2c_address'] != addr:
+                    continue
+            except OSError:
+                continue
+            cameras.append(camera)
+    if not cameras:
+        raise CameraDetectError("No camera detected")
+    return cameras
+
+
 class RefreshRate:
     values = tuple(range(8))
 
@@ -62,6 +102,10 @@ CameraState = namedtuple('CameraState',
                          ('vdd', 'ta', 'ta_r', 'gain', 'gain_cp'))
 
 
+# RAM fields read together by MLX90640.read_state()
+_STATE_FIELDS = ('gain', 'cp_sp_0', 'cp_sp_1', 'ta_ptat', 'ta_vbe', 'vdd_pix')
+
+
 class DataNotAvailableError(Exception):
     pass
 
@@ -72,29 +116,80 @@ class MLX90640:
         """!
         """
         self.iface = CameraInterface(i2c, addr)
-        self.registers = RegisterMap(self.iface, REGISTER_MAP)
-        self.eeprom = RegisterMap(self.iface, EEPROM_MAP, readonly=True)
+        self.registers = RegisterMap(self.iface, REGISTER_MAP, cache=True,
+                                     volatile=VOLATILE_REGISTERS)
+        self.eeprom = RegisterMap(self.iface, EEPROM_MAP, readonly=True,
+                                  cache=True)
         self.calib = None
+        self.frames = None
         self.raw = None
-#         self.image = None
+        self.image = None
+        self.bad_pixels = None
+        self.roi = None
         self.last_read = None
+        self._read_pos = 0
+        self._slot = None
+        self.min_free = None
+        self.process_us = None
 
 
-    def setup(self, *, calib=None, raw=None, image=None):
+    def setup(self, *, calib=None, raw=None, image=None, frames=1,
+              calibrated=False, calib_file='mlx90640.cal', bad_pixels=False):
         """!
+        @param frames How many past frames to keep in the frame ring; raw
+               is the latest one
+        @param calibrated Whether to set up calibrated output as well as raw
+               data; this is done anyway if calib or image is given
+        @param calib_file File in which the derived calibration tables are
+               kept between boots, or None to derive them every time
+        @param bad_pixels Whether to replace the pixels the EEPROM flags as
+               outliers or failed with the mean of their neighbours in the
+               calibrated image; raw frames are always left as read. Without
+               calibration this costs another read of the whole EEPROM
         """
         # We've been having some memory allocation errors which usually happen
         # as this method runs. As a workaround, run gc.collect() several times
         # to keep memory cleaned up, as when the process is finished, there is
         # a bunch of free memory (~27KB or more on STM32L476) available
-#         collect()
-#         self.calib = calib or CameraCalibration(self.iface, self.eeprom)
+        # The lowest free memory seen is kept to check the footprint.
         collect()
+        self.min_free = mem_free()
+        if calibrated or calib is not None or image is not None:
+            self.calib = calib or self._read_calibration(calib_file)
+            self.min_free = min(self.min_free, mem_free())
+            collect()
+            self.image = image or ProcessedImage(self.calib)
+            self.min_free = min(self.min_free, mem_free())
+            collect()
 #         print(f"setup: {mem_free()}", end='')
-        self.raw = raw or RawImage()
+        self.frames = FrameRing(frames, raw)
+        self.raw = self.frames.latest()
+        self.min_free = min(self.min_free, mem_free())
         collect()
+        if bad_pixels:
+            self.bad_pixels = BadPixelMap(self.read_bad_pixels())
+            self.min_free = min(self.min_free, mem_free())
+            collect()
 #         print(f" -> {mem_free()}")
-#         self.image = image or ProcessedImage(self.calib)
+
+
+    def _read_calibration(self, calib_file):
+        # the EEPROM is read in one transfer and the register map served
+        # from that copy, so building the calibration needs no more I2C reads
+        ee_data = read_eeprom(self.iface)
+        self.eeprom.load(EEPROM_ADDRESS, ee_data)
+        self.min_free = min(self.min_free, mem_free())
+        return CameraCalibration(ee_data, self.eeprom, cache_file=calib_file)
+
+
+    def read_bad_pixels(self):
+        """!
+        Pixels flagged as outliers or failed in the EEPROM. Without calibration
+        data the EEPROM is read just for this.
+        """
+        if self.calib is not None:
+            return tuple(self.calib.outliers) + tuple(self.calib.failed)
+        return read_bad_pixels(read_eeprom(self.iface))
 
 
     @property
@@ -124,59 +219,65 @@ class MLX90640:
 
     def read_vdd(self):
         """!
-        Turned off to save memory for raw driver version.
+        Without calibration data the raw supply voltage reading is returned.
         """
         # supply voltage calculation (delta Vdd)
         # type: (self) -> float
         vdd_pix = self.registers['vdd_pix'] * self._adc_res_corr()
-#         return float(vdd_pix - self.calib.vdd_25)/self.calib.k_vdd
-        return float(vdd_pix)
+        if self.calib is None:
+            return float(vdd_pix)
+        return float(vdd_pix - self.calib.vdd_25)/self.calib.k_vdd
 
 
     def _adc_res_corr(self):
         """!
-        Turned off to save memory for raw driver version.
         """
         # type: (self) -> float
-#         res_exp = self.calib.res_ee - self.registers['adc_resolution']
-#         return 1 << res_exp
-        return 0
+        if self.calib is None:
+            return 1
+        res_exp = self.calib.res_ee - self.registers['adc_resolution']
+        return 1 << res_exp
 
 
     def read_ta(self):
         """!
-        Turned off to save memory for raw driver version.
+        Without calibration data 0.0 is returned.
         """
         # ambient temperature calculation (delta Ta in degC)
         # type: (self) -> float
+        if self.calib is None:
+            return 0.0
         v_ptat = self.registers['ta_ptat']
         v_be = self.registers['ta_vbe']
-#         v_ptat_art = v_ptat/(v_ptat*self.calib.alpha_ptat + v_be) * 262144
-# 
-#         v_ta = v_ptat_art/(1.0 + self.calib.kv_ptat*self.read_vdd() - self.calib.ptat_25)
+        v_ptat_art = v_ptat/(v_ptat*self.calib.alpha_ptat + v_be) * 262144
+
+        v_ta = v_ptat_art/(1.0 + self.calib.kv_ptat*self.read_vdd() - self.calib.ptat_25)
 
         # print('v_ptat: ', v_ptat)
         # print('v_be:', v_be)
         # print('v_ptat_art: ', v_ptat_art)
 
-#         return v_ta/self.calib.kt_ptat
-        return 0.0
+        return v_ta/self.calib.kt_ptat
 
 
     def read_gain(self):
         """!
-        Turned off to save memory for raw driver version.
+        Without calibration data the raw gain reading is returned.
         """
         # gain calculation
         # type: (self) -> float
-#         return self.calib.gain / self.registers['gain']
-        return float(self.registers['gain'])
+        if self.calib is None:
+            return float(self.registers['gain'])
+        return self.calib.gain / self.registers['gain']
 
 
     # tr - temperature of reflected environment
     def read_state(self, *, tr=None):
         """!
         """
+        # fetch all of the RAM values used below in one go
+        self.registers.refresh(*_STATE_FIELDS)
+
         gain = self.read_gain()
         cp_sp_0 = gain * self.registers['cp_sp_0']
         cp_sp_1 = gain * self.registers['cp_sp_1']
@@ -184,28 +285,33 @@ class MLX90640:
         ta = self.read_ta()
 
         ta_abs = ta + 25
-#         if self.calib.emissivity == 1:
-        ta_r = (ta_abs + TEMP_K)**4
-#         else:
-#             tr = tr if tr is not None else ta_abs - 8
-#             ta_k4 = (ta_abs + TEMP_K)**4
-#             tr_k4 = (tr + TEMP_K)**4
-#             ta_r = tr_k4 - (tr_k4 - ta_k4)/self.calib.emissivity
-
-        return CameraState(
+        if self.calib is None or self.calib.emissivity == 1:
+            ta_r = (ta_abs + TEMP_K)**4
+        else:
+            tr = tr if tr is not None else ta_abs - 8
+            ta_k4 = (ta_abs + TEMP_K)**4
+            tr_k4 = (tr + TEMP_K)**4
+            ta_r = tr_k4 - (tr_k4 - ta_k4)/self.calib.emissivity
+
+        state = CameraState(
             vdd = self.read_vdd(),
             ta = ta,
             ta_r = ta_r,
             gain = gain,
             gain_cp = (cp_sp_0, cp_sp_1),
         )
+        self.registers.invalidate(*_STATE_FIELDS)
+        return state
 
 
     @property
     def has_data(self):
         """!
-        Report whether there's data available from the camera.
+        Report whether there's data available from the camera. The status
+        register is refreshed, so last_subpage can be read without another
+        transaction.
         """
+        self.registers.refresh('data_available')
         return bool(self.registers['data_available'])
 
 
@@ -222,33 +328,82 @@ class MLX90640:
         if not self.has_data:
             raise DataNotAvailableError
 
+        self.start_read(sp_id)
+        self.read_rows(NUM_ROWS)
+        return self.finish_read()
+
+
+    def start_read(self, sp_id = None):
+        """!
+        Begin reading a subpage a few rows at a time with read_rows(). The
+        caller should have checked has_data first.
+        @returns The Subpage being read
+        """
         if sp_id is None:
             sp_id = self.last_subpage
 
         subpage = Subpage(self.get_pattern(), sp_id)
         self.last_read = subpage
+        self._read_pos = 0
+        self._slot = self.frames.begin(sp_id, subpage.pattern.pattern_id,
+                                       ticks_us())
+        return subpage
+
+
+    def read_table(self):
+        """!
+        Indices of the pixels read for the subpage started by start_read():
+        the whole subpage, or just the part of it inside roi.
+        """
+        if self.roi is None:
+            return self.last_read.sp_range()
+        return self.roi.table(self.last_read.pattern, self.last_read.id)
+
+
+    def read_rows(self, row_stop):
+        """!
+        Read the pixels of the subpage started by start_read() which lie above
+        row row_stop and have not been read yet. If roi is set, only pixels
+        inside it are read and pixels outside keep their old values.
+        @returns True once the whole subpage has been read
+        """
+        table = self.read_table()
+
+        # print(f"read SP {self.last_read.id} to row {row_stop}")
+        self._read_pos = self._slot.read_part(self.iface, table, self._read_pos,
+                                              row_stop * NUM_COLS, self.roi)
+        return self._read_pos >= len(table)
+
 
-        # print(f"read SP {subpage.id}")
-        self.raw.read(self.iface, subpage.sp_range())
+    def finish_read(self):
+        """!
+        Tell the camera that the subpage has been read, and make the frame it
+        was read into the latest one.
+        """
         self.registers['data_available'] = 0
+        self.registers.invalidate('data_available')
+        self.raw = self.frames.commit()
         return self.raw
 
 
-#     def process_image(self, sp_id = None, state = None):
-#         """!
-#         """
-#         if self.last_read is None:
-#             raise DataNotAvailableError
-# 
-#         subpage = self.last_read
-#         if sp_id is not None:
-#             subpage.id = sp_id
-# 
-#         state = state or self.read_state()
-# 
-#         # print(f"process SP {subpage.id}")
-#         raw_data = ((idx, self.raw[idx]) for idx in subpage.sp_range())
-#         self.image.update(raw_data, subpage, state)
-#         return self.image
+    def process_image(self, sp_id = None, state = None):
+        """!
+        Compensate the subpage which was read last into calibrated data. The
+        time taken is kept in process_us.
+        """
+        if self.last_read is None:
+            raise DataNotAvailableError
+
+        t_start = ticks_us()
+        subpage = self.last_read
+        if sp_id is not None:
+            subpage.id = sp_id
 
+        state = state or self.read_state()
 
+        # print(f"process SP {subpage.id}")
+        self.image.update(self.raw.pix, subpage, state)
+        if self.bad_pixels is not None:
+            self.bad_pixels.apply(self.image.buf)
+        self.process_us = ticks_diff(ticks_us(), t_start)
+        return self.image
@@ -1,10 +1,14 @@
+import struct
 from array import array
+from binascii import crc32
 from mlx90640.utils import (
-    Struct, 
+    const,
     StructProto,
     field_desc,
+    array_filled,
+    twos_complement,
 )
-from mlx90640.regmap import REG_SIZE
+from mlx90640.regmap import REG_SIZE, EEPROM_ADDRESS, EEPROM_SIZE
 
 NUM_ROWS = const(24)
 NUM_COLS = const(32)
@@ -23,68 +27,116 @@ CC_PROTO = StructProto((
     field_desc('3', 4, 12, signed=True),
 ))
 
-def _read_cc_iter(iface, base, size):
-    buf = bytearray(REG_SIZE)
-    struct = Struct(buf, CC_PROTO)
+def read_eeprom(iface):
+    # the whole EEPROM in one transfer
+    ee_data = bytearray(EEPROM_SIZE * REG_SIZE)
+    iface.read_into(EEPROM_ADDRESS, ee_data)
+    return ee_data
+
+def _ee_offset(address):
+    return (address - EEPROM_ADDRESS) * REG_SIZE
+
+def _read_cc_iter(ee_data, base, size):
     for addr_off in range(size // 4):
-        cc_addr = base + addr_off
-        iface.read_into(cc_addr, buf)
-        yield struct['0']
-        yield struct['1']
-        yield struct['2']
-        yield struct['3']
-
-def read_occ_rows(iface):
-    return _read_cc_iter(iface, OCC_ROWS_ADDRESS, NUM_ROWS)
-def read_occ_cols(iface):
-    return _read_cc_iter(iface, OCC_COLS_ADDRESS, NUM_COLS)
-
-def read_acc_rows(iface):
-    return _read_cc_iter(iface, ACC_ROWS_ADDRESS, NUM_ROWS)
-def read_acc_cols(iface):
-    return _read_cc_iter(iface, ACC_COLS_ADDRESS, NUM_COLS)
-
-PIX_CALIB_PROTO = StructProto((
-    field_desc('offset',  6, 10, signed=True),
-    field_desc('alpha',   6,  4, signed=True),
-    field_desc('kta',     3,  1, signed=True),
-    field_desc('outlier', 1,  0),
-))
+        offset = _ee_offset(base + addr_off)
+        word = ee_data[offset] << 8 | ee_data[offset + 1]
+        yield CC_PROTO.decode('0', word)
+        yield CC_PROTO.decode('1', word)
+        yield CC_PROTO.decode('2', word)
+        yield CC_PROTO.decode('3', word)
+
+def read_occ_rows(ee_data):
+    return _read_cc_iter(ee_data, OCC_ROWS_ADDRESS, NUM_ROWS)
+def read_occ_cols(ee_data):
+    return _read_cc_iter(ee_data, OCC_COLS_ADDRESS, NUM_COLS)
+
+def read_acc_rows(ee_data):
+    return _read_cc_iter(ee_data, ACC_ROWS_ADDRESS, NUM_ROWS)
+def read_acc_cols(ee_data):
+    return _read_cc_iter(ee_data, ACC_COLS_ADDRESS, NUM_COLS)
 
 PIX_CALIB_ADDRESS = const(0x2440)
 
 
 class PixelCalibrationData:
-    def __init__(self, iface):
+    # per-pixel calibration words, decoded once into one compact array per
+    # field; each word holds (from the MSB) offset:6, alpha:6, kta:3, outlier:1
+    def __init__(self, ee_data):
         pix_count = NUM_ROWS * NUM_COLS
-        self._data = bytearray(pix_count * REG_SIZE)
+        self.offset = array_filled('b', pix_count)
+        self.alpha = array_filled('b', pix_count)
+        self.kta = array_filled('b', pix_count)
+        self.outlier = bytearray((pix_count + 7) // 8)  # bitmap
 
         failed = []
-        buf = bytearray(REG_SIZE)
+        pos = _ee_offset(PIX_CALIB_ADDRESS)
         for idx in range(pix_count):
-            offset = idx * REG_SIZE
-            iface.read_into(PIX_CALIB_ADDRESS + offset, buf)
-            if buf != bytes(REG_SIZE):
-                self._data[offset:offset+REG_SIZE] = buf
-            else:
+            word = ee_data[pos] << 8 | ee_data[pos + 1]
+            pos += REG_SIZE
+            if not word:
+                # an all-zero word means the pixel's data couldn't be read
                 failed.append(idx)
+                continue
+            self.offset[idx] = twos_complement(6, word >> 10)
+            self.alpha[idx] = twos_complement(6, (word >> 4) & 0x3F)
+            self.kta[idx] = twos_complement(3, (word >> 1) & 0x07)
+            if word & 0x01:
+                self.outlier[idx >> 3] |= 1 << (idx & 7)
         self.failed = tuple(failed)
 
     def __len__(self):
-        return len(self._data)//REG_SIZE
-    def __getitem__(self, idx):
-        offset = idx * REG_SIZE
-        return Struct(self._data[offset:offset+REG_SIZE], PIX_CALIB_PROTO)
-    def __iter__(self):
-        for idx in range(len(self)):
-            yield self[idx]
+        return len(self.offset)
+
+    def is_outlier(self, idx):
+        return bool(self.outlier[idx >> 3] & 1 << (idx & 7))
+
+    def outliers(self):
+        return (idx for idx in range(len(self)) if self.is_outlier(idx))
+
+def read_bad_pixels(ee_data):
+    # indices of pixels flagged as outliers or whose calibration word is
+    # all zero, straight from the EEPROM image without decoding the rest
+    bad = []
+    pos = _ee_offset(PIX_CALIB_ADDRESS)
+    for idx in range(NUM_ROWS * NUM_COLS):
+        if ee_data[pos + 1] & 0x01 or not (ee_data[pos] or ee_data[pos + 1]):
+            bad.append(idx)
+        pos += REG_SIZE
+    return tuple(bad)
 
 TEMP_K = 273.15
 
+# calibration cache file layout: a header, the scalars below as floats, then
+# the outlier and failed pixel lists and the per-pixel tables as raw arrays
+_CACHE_MAGIC = b'MLXC'
+_CACHE_VERSION = const(1)
+_CACHE_HEADER = '<4sHHIfHH'  # magic, version, res_ee, key, emissivity, counts
+_CACHE_SCALARS = (
+    'k_vdd', 'vdd_25', 'kv_ptat', 'kt_ptat', 'ptat_25', 'alpha_ptat', 'gain',
+    'ksta', 'tgc', 'kta_cp', 'kv_cp', 'il_chess_c1', 'il_chess_c2',
+    'il_chess_c3', 'drift',
+)
+_CACHE_TUPLES = ('kv_avg', 'pix_os_cp', 'pix_alpha_cp', 'ksto', 'ct', 'alpha_ext')
+
 class CameraCalibration:
-    def __init__(self, iface, eeprom, *, emissivity=1, use_tgc=False):
+    def __init__(self, ee_data, eeprom, *, emissivity=1, use_tgc=False,
+                 cache_file=None):
+        # ee_data is the whole EEPROM as read by read_eeprom(), and eeprom a
+        # RegisterMap which has been loaded from it. If cache_file is given
+        # the derived tables are saved there, and loaded instead of being
+        # derived again as long as the EEPROM contents match.
         self.emissivity = emissivity
+        # tgc only available for device type 'C'
+        self.use_tgc = use_tgc
 
+        key = crc32(ee_data)
+        if cache_file is not None and self._load(cache_file, key):
+            return
+        self._calculate(ee_data, eeprom)
+        if cache_file is not None:
+            self._save(cache_file, key)
+
+    def _calculate(self, ee_data, eeprom):
         # restore VDD sensor parameters
         self.k_vdd = eeprom['k_vdd'] * 32
         self.vdd_25 = (eeprom['vdd_25'] - 256) * 32 - 8192
@@ -102,9 +154,9 @@ class CameraCalibration:
         self.gain = eeprom['gain']
 
         # pixel calibration data
-        self.pix_data = PixelCalibrationData(iface)
-        self.pix_os_ref = array('h', self._calc_pix_os_ref(iface, eeprom))
-        self.outliers = tuple(idx for idx, data in enumerate(self.pix_data) if data['outlier'])
+        self.pix_data = PixelCalibrationData(ee_data)
+        self.pix_os_ref = array('h', self._calc_pix_os_ref(ee_data, eeprom))
+        self.outliers = tuple(self.pix_data.outliers())
 
         # IR data compensation
         self.kta_scale_1 = 1 << (eeprom['kta_scale_1'] + 8)
@@ -119,36 +171,32 @@ class CameraCalibration:
         )
         
         # IR gradient compensation
+        # (only used with use_tgc, but cheap enough to keep in the cache)
+        self.tgc = eeprom['tgc'] / 32.0
 
-        # tgc only available for device type 'C'
-        self.use_tgc = use_tgc
-
-        if use_tgc:
-            self.tgc = eeprom['tgc'] / 32.0 if use_tgc else False
-
-            offset_cp_sp_0 = eeprom['offset_cp_sp_0']
-            offset_cp_sp_1 = offset_cp_sp_0 + eeprom['offset_cp_delta']
-            self.pix_os_cp = (offset_cp_sp_0, offset_cp_sp_1)
+        offset_cp_sp_0 = eeprom['offset_cp_sp_0']
+        offset_cp_sp_1 = offset_cp_sp_0 + eeprom['offset_cp_delta']
+        self.pix_os_cp = (offset_cp_sp_0, offset_cp_sp_1)
 
-            self.kta_cp = eeprom['kta_cp'] / self.kta_scale_1
-            self.kv_cp = eeprom['kv_cp'] / self.kv_scale
+        self.kta_cp = eeprom['kta_cp'] / self.kta_scale_1
+        self.kv_cp = eeprom['kv_cp'] / self.kv_scale
 
         # sensitivity normalization
-        self.pix_alpha = array('f', self._calc_pix_alpha_ref(iface, eeprom))
+        self.pix_alpha = array('f', self._calc_pix_alpha_ref(ee_data, eeprom))
         self.ksta = eeprom['ksta'] / 8192.0
 
-        if use_tgc:
-            alpha_scale_cp = 1 << (eeprom['alpha_scale'] + 27)
-            cp_sp_ratio = eeprom['cp_sp_ratio']
-            pix_alpha_cp_sp_0 = eeprom['alpha_cp_sp_0'] / alpha_scale_cp
-            pix_alpha_cp_sp_1 = pix_alpha_cp_sp_0*(1 + cp_sp_ratio/128.0)
-            self.pix_alpha_cp = (pix_alpha_cp_sp_0, pix_alpha_cp_sp_1)
+        alpha_scale_cp = 1 << (eeprom['alpha_scale'] + 27)
+        cp_sp_ratio = eeprom['cp_sp_ratio']
+        pix_alpha_cp_sp_0 = eeprom['alpha_cp_sp_0'] / alpha_scale_cp
+        pix_alpha_cp_sp_1 = pix_alpha_cp_sp_0*(1 + cp_sp_ratio/128.0)
+        self.pix_alpha_cp = (pix_alpha_cp_sp_0, pix_alpha_cp_sp_1)
 
         # interleaved pattern
         self.il_chess_c1 = eeprom['il_chess_c1'] / 16.0
         self.il_chess_c2 = eeprom['il_chess_c2'] / 2.0
         self.il_chess_c3 = eeprom['il_chess_c3'] / 8.0
-        self.il_offset = array('f', self._calc_il_offset())
+        # il_offset is only needed for the interleaved pattern, so it is left
+        # to the image to build it from calc_il_offset() if it is used
 
         # temperature calculation
         self.drift = 0  # temperature drift correction
@@ -173,14 +221,92 @@ class CameraCalibration:
         alpha_4 = alpha_3*(1.0 + ksto3*(ct4 - ct3))
         self.alpha_ext = (alpha_1, alpha_2, alpha_3, alpha_4)
 
-    def _calc_pix_os_ref(self, iface, eeprom):
+        # the raw EEPROM words aren't needed once the tables are built
+        self.failed = self.pix_data.failed
+        self.pix_data = None
+
+    def _save(self, path, key):
+        outliers = array('H', self.outliers)
+        failed = array('H', self.failed)
+        scalars = [getattr(self, name) for name in _CACHE_SCALARS]
+        for name in _CACHE_TUPLES:
+            for value in getattr(self, name):
+                if isinstance(value, tuple):
+                    scalars.extend(value)
+                else:
+                    scalars.append(value)
+        try:
+            with open(path, 'wb') as f:
+                f.write(struct.pack(_CACHE_HEADER, _CACHE_MAGIC, _CACHE_VERSION,
+                                    self.res_ee, key, self.emissivity,
+                                    len(outliers), len(failed)))
+                f.write(array('f', scalars))
+                f.write(outliers)
+                f.write(failed)
+                f.write(self.pix_os_ref)
+                f.write(self.pix_kta)
+                f.write(self.pix_alpha)
+        except OSError:
+            pass  # no room on the filesystem; derive the tables next time
+
+    def _load(self, path, key):
+        # returns False if there is no usable cache for this EEPROM
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(struct.calcsize(_CACHE_HEADER))
+                if len(header) != struct.calcsize(_CACHE_HEADER):
+                    return False
+                (magic, version, res_ee, file_key, emissivity,
+                 n_outliers, n_failed) = struct.unpack(_CACHE_HEADER, header)
+                if (magic != _CACHE_MAGIC or version != _CACHE_VERSION
+                        or file_key != key
+                        or emissivity != array('f', (self.emissivity,))[0]):
+                    return False
+
+                scalars = array_filled('f', len(_CACHE_SCALARS) + 20, 0.0)
+                outliers = array_filled('H', n_outliers)
+                failed = array_filled('H', n_failed)
+                pix_os_ref = array_filled('h', IMAGE_SIZE)
+                pix_kta = array_filled('f', IMAGE_SIZE, 0.0)
+                pix_alpha = array_filled('f', IMAGE_SIZE, 0.0)
+                for buf, item_size in ((scalars, 4), (outliers, 2), (failed, 2),
+                                       (pix_os_ref, 2), (pix_kta, 4),
+                                       (pix_alpha, 4)):
+                    if len(buf) and f.readinto(buf) != len(buf) * item_size:
+                        return False
+        except OSError:
+            return False
+
+        self.res_ee = res_ee
+        for idx, name in enumerate(_CACHE_SCALARS):
+            setattr(self, name, scalars[idx])
+        pos = len(_CACHE_SCALARS)
+        self.kv_avg = (
+            (scalars[pos], scalars[pos + 1]),
+            (scalars[pos + 2], scalars[pos + 3]),
+        )
+        pos += 4
+        for name, count in (('pix_os_cp', 2), ('pix_alpha_cp', 2),
+                            ('ksto', 4), ('ct', 4), ('alpha_ext', 4)):
+            setattr(self, name, tuple(scalars[pos:pos + count]))
+            pos += count
+
+        self.outliers = tuple(outliers)
+        self.failed = tuple(failed)
+        self.pix_os_ref = pix_os_ref
+        self.pix_kta = pix_kta
+        self.pix_alpha = pix_alpha
+        self.pix_data = None
+        return True
+
+    def _calc_pix_os_ref(self, ee_data, eeprom):
         offset_avg = eeprom['pix_os_average']
         occ_scale_row = 1 << eeprom['scale_occ_row']
         occ_scale_col = 1 << eeprom['scale_occ_col']
         occ_scale_rem = 1 << eeprom['scale_occ_rem']
 
-        occ_rows = tuple(read_occ_rows(iface))
-        occ_cols = tuple(read_occ_cols(iface))
+        occ_rows = tuple(read_occ_rows(ee_data))
+        occ_cols = tuple(read_occ_cols(ee_data))
 
         for row in range(NUM_ROWS):
             for col in range(NUM_COLS):
@@ -189,18 +315,18 @@ class CameraCalibration:
                     offset_avg
                     + occ_rows[row] * occ_scale_row
                     + occ_cols[col] * occ_scale_col
-                    + self.pix_data[idx]['offset'] * occ_scale_rem
+                    + self.pix_data.offset[idx] * occ_scale_rem
                 )
 
-    def _calc_pix_alpha_ref(self, iface, eeprom):
+    def _calc_pix_alpha_ref(self, ee_data, eeprom):
         alpha_ref = eeprom['pix_sensitivity_average']
         alpha_scale = 1 << (eeprom['alpha_scale'] + 30)
         acc_scale_row = 1 << eeprom['scale_acc_row']
         acc_scale_col = 1 << eeprom['scale_acc_col']
         acc_scale_rem = 1 << eeprom['scale_acc_rem']
 
-        acc_rows = tuple(read_acc_rows(iface))
-        acc_cols = tuple(read_acc_cols(iface))
+        acc_rows = tuple(read_acc_rows(ee_data))
+        acc_cols = tuple(read_acc_cols(ee_data))
 
         for row in range(NUM_ROWS):
             for col in range(NUM_COLS):
@@ -209,7 +335,7 @@ class CameraCalibration:
                     alpha_ref
                     + acc_rows[row] * acc_scale_row
                     + acc_cols[col] * acc_scale_col
-                    + self.pix_data[idx]['alpha'] * acc_scale_rem
+                    + self.pix_data.alpha[idx] * acc_scale_rem
                 ) / alpha_scale
 
     def _calc_pix_kta(self, eeprom):
@@ -222,11 +348,11 @@ class CameraCalibration:
         for row in range(NUM_ROWS):
             for col in range(NUM_COLS):
                 idx = row * NUM_COLS + col
-                kta_ee = self.pix_data[idx]['kta']
+                kta_ee = self.pix_data.kta[idx]
                 kta_rc = kta_avg[row % 2][col % 2]
                 yield (kta_rc + kta_ee * self.kta_scale_2)/self.kta_scale_1
 
-    def _calc_il_offset(self):
+    def calc_il_offset(self):
         for idx in range(NUM_ROWS*NUM_COLS):
             il_pattern = idx//32 - (idx//64)*2
             conv_pattern = (
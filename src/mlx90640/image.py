@@ -4,15 +4,17 @@ This file contains image storage and processing classes for the MLX90640 camera
 driver.
 
 RAW VERSION
-This version is a stripped down MLX90640 driver which produces only raw data,
-not calibrated data, in order to save memory.
+This version is a stripped down MLX90640 driver which produces raw data by
+default in order to save memory. ProcessedImage gives calibrated data from
+a few precomputed coefficient tables when it is asked for.
 """
 
 import math
 import struct
 from array import array
-from ucollections import namedtuple
 from mlx90640.utils import (
+    const,
+    namedtuple,
     Struct,
     StructProto,
     field_desc,
@@ -20,14 +22,25 @@ from mlx90640.utils import (
 )
 
 from mlx90640.regmap import REG_SIZE
-from mlx90640.calibration import NUM_COLS, IMAGE_SIZE, TEMP_K
+from mlx90640.calibration import NUM_ROWS, NUM_COLS, IMAGE_SIZE, TEMP_K
 
 PIX_STRUCT_FMT = '>h'
 PIX_DATA_ADDRESS = const(0x0400)
 
 class _BasePattern:
+    # subpage membership tables, built on first use and shared between frames
+    _sp_tables = None
+
     @classmethod
     def sp_range(cls, sp_id):
+        if cls._sp_tables is None:
+            cls._sp_tables = tuple(
+                array('H', cls._iter_sp_range(sp)) for sp in (0, 1)
+            )
+        return cls._sp_tables[sp_id]
+
+    @classmethod
+    def _iter_sp_range(cls, sp_id):
         return (
             idx for idx, sp in enumerate(cls.iter_sp()) 
             if sp == sp_id
@@ -41,6 +54,7 @@ class _BasePattern:
 
 class ChessPattern(_BasePattern):
     pattern_id = 0x1
+    _sp_tables = None
 
     @classmethod
     def get_sp(cls, idx):
@@ -48,6 +62,7 @@ class ChessPattern(_BasePattern):
 
 class InterleavedPattern(_BasePattern):
     pattern_id = 0x0
+    _sp_tables = None
 
     @classmethod
     def get_sp(cls, idx):
@@ -73,19 +88,210 @@ class Subpage:
 ## Image Buffers
 
 class RawImage:
-    def __init__(self):
+    def __init__(self, chunk_rows=NUM_ROWS):
+        # chunk_rows sets how many pixel rows are fetched per I2C transaction,
+        # by default a whole subpage's worth in one; fewer rows use a smaller
+        # buffer, and None falls back to reading one pixel per transaction
         self.pix = array_filled('h', IMAGE_SIZE)
+        self.chunk_rows = chunk_rows
+        # capture info for the frame, filled in by FrameRing.begin()
+        self.seq = -1
+        self.ticks = 0
+        self.sp_id = None
+        self.pattern_id = None
+        if chunk_rows:
+            self._buf = bytearray(chunk_rows * NUM_COLS * REG_SIZE)
+        else:
+            self._buf = bytearray(REG_SIZE)
 
     def __getitem__(self, idx):
         return self.pix[idx]
 
-    def read(self, iface, update_idx = None):
-        buf = bytearray(REG_SIZE)
-        update_idx = update_idx or range(IMAGE_SIZE)
+    def read(self, iface, update_idx = None, roi = None, stop = IMAGE_SIZE):
+        # with an roi, only pixels inside it are read (by default all of
+        # them), and rows are fetched only across the roi's columns; bulk
+        # reads never fetch from pixel offset stop onwards
+        if update_idx is None:
+            update_idx = roi.indices() if roi else range(IMAGE_SIZE)
+        if self.chunk_rows:
+            cols = roi.cols if roi else None
+            if cols:
+                self._read_spans(iface, update_idx, cols[0], cols[1])
+            else:
+                if roi:
+                    stop = min(stop, roi.row_stop * NUM_COLS)
+                self._read_bulk(iface, update_idx, min(stop, IMAGE_SIZE))
+        else:
+            self._read_pixels(iface, update_idx)
+
+    def read_part(self, iface, table, pos, stop, roi = None):
+        # read the pixels listed in table from position pos onwards which lie
+        # before pixel offset stop; returns the position to continue from
+        if stop >= IMAGE_SIZE:
+            end = len(table)
+        else:
+            end = pos
+            while end < len(table) and table[end] < stop:
+                end += 1
+        if end > pos:
+            self.read(iface, memoryview(table)[pos:end], roi, stop)
+        return end
+
+    def _read_pixels(self, iface, update_idx):
+        buf = self._buf
         for offset in update_idx:
             iface.read_into(PIX_DATA_ADDRESS + offset, buf)
             self.pix[offset] = struct.unpack(PIX_STRUCT_FMT, buf)[0]
 
+    def _read_bulk(self, iface, update_idx, stop=IMAGE_SIZE):
+        # update_idx must be ascending and below stop; a chunk of rows is
+        # fetched starting from the row of the first pixel needed, without
+        # going past stop, and only the requested pixels are decoded from it,
+        # straight into self.pix
+        buf = self._buf
+        pix = self.pix
+        chunk_size = self.chunk_rows * NUM_COLS
+        chunk_start = -IMAGE_SIZE
+        for offset in update_idx:
+            pos = offset - chunk_start
+            if pos >= chunk_size:
+                chunk_start = offset - offset % NUM_COLS
+                pos = offset - chunk_start
+                self._read_chunk(iface, chunk_start,
+                                 min(chunk_size, stop - chunk_start))
+            pos *= REG_SIZE
+            word = buf[pos] << 8 | buf[pos + 1]
+            pix[offset] = word - 0x10000 if word & 0x8000 else word
+
+    def _read_spans(self, iface, update_idx, col_start, col_stop):
+        # like _read_bulk, but each row is fetched only from col_start to
+        # col_stop; update_idx must be ascending and inside those columns
+        buf = self._buf
+        pix = self.pix
+        span = col_stop - col_start
+        view = memoryview(buf)[:span * REG_SIZE]
+        span_start = -IMAGE_SIZE
+        for offset in update_idx:
+            pos = offset - span_start
+            if pos >= span:
+                span_start = offset - offset % NUM_COLS + col_start
+                pos = offset - span_start
+                iface.read_into(PIX_DATA_ADDRESS + span_start, view)
+            pos *= REG_SIZE
+            word = buf[pos] << 8 | buf[pos + 1]
+            pix[offset] = word - 0x10000 if word & 0x8000 else word
+
+    def _read_chunk(self, iface, start, size):
+        size = min(size, IMAGE_SIZE - start)
+        if size == self.chunk_rows * NUM_COLS:
+            iface.read_into(PIX_DATA_ADDRESS + start, self._buf)
+        else:
+            iface.read_into(PIX_DATA_ADDRESS + start,
+                            memoryview(self._buf)[:size * REG_SIZE])
+
+
+class Roi:
+    # rectangular window of the image to read: rows row_start to row_stop and
+    # columns col_start to col_stop (memory order, stops exclusive). Each
+    # subpage's index table restricted to the window is rebuilt in place
+    # when the window changes, so moving it allocates nothing
+    def __init__(self, row_start=0, row_stop=NUM_ROWS, col_start=0,
+                 col_stop=NUM_COLS):
+        self._tables = (array_filled('H', IMAGE_SIZE // 2),
+                        array_filled('H', IMAGE_SIZE // 2))
+        self._counts = [0, 0]
+        self._pattern = None
+        self.row_start = self.row_stop = None
+        self.col_start = self.col_stop = None
+        self.set(row_start, row_stop, col_start, col_stop)
+
+    def set(self, row_start, row_stop, col_start, col_stop):
+        if not (0 <= row_start < row_stop <= NUM_ROWS
+                and 0 <= col_start < col_stop <= NUM_COLS):
+            raise ValueError('ROI outside the image')
+        if (row_start, row_stop, col_start, col_stop) != (
+                self.row_start, self.row_stop, self.col_start, self.col_stop):
+            self.row_start = row_start
+            self.row_stop = row_stop
+            self.col_start = col_start
+            self.col_stop = col_stop
+            self._pattern = None  # tables are rebuilt on next use
+
+    @property
+    def cols(self):
+        # column span to fetch rows across, or None for whole rows
+        if self.col_start == 0 and self.col_stop == NUM_COLS:
+            return None
+        return (self.col_start, self.col_stop)
+
+    def __contains__(self, idx):
+        row = idx // NUM_COLS
+        col = idx - row * NUM_COLS
+        return (self.row_start <= row < self.row_stop
+                and self.col_start <= col < self.col_stop)
+
+    def indices(self):
+        return (
+            row * NUM_COLS + col
+            for row in range(self.row_start, self.row_stop)
+            for col in range(self.col_start, self.col_stop)
+        )
+
+    def table(self, pattern, sp_id):
+        if pattern is not self._pattern:
+            for sp in (0, 1):
+                table = self._tables[sp]
+                count = 0
+                for idx in pattern.sp_range(sp):
+                    if idx in self:
+                        table[count] = idx
+                        count += 1
+                self._counts[sp] = count
+            self._pattern = pattern
+        return memoryview(self._tables[sp_id])[:self._counts[sp_id]]
+
+class FrameRing:
+    # fixed set of RawImage slots which are reused in turn; each slot holds
+    # the whole image as it was when one subpage had been read into it
+    def __init__(self, capacity=1, image=None):
+        slots = [image or RawImage()]
+        for _ in range(capacity - 1):
+            slots.append(RawImage(slots[0].chunk_rows))
+        self.slots = tuple(slots)
+        self.head = 0   # slot holding the latest complete frame
+        self.count = 0  # number of frames committed so far
+
+    def __len__(self):
+        return min(self.count, len(self.slots))
+
+    def latest(self):
+        return self.slots[self.head]
+
+    def get(self, age=0):
+        # the frame committed age frames before the latest one, without copying
+        if age >= len(self):
+            raise IndexError(age)
+        return self.slots[(self.head - age) % len(self.slots)]
+
+    def begin(self, sp_id, pattern_id, ticks):
+        # return the slot to read the next subpage into; it starts out as a
+        # copy of the latest frame so the other subpage carries over
+        latest = self.slots[self.head]
+        slot = self.slots[(self.head + 1) % len(self.slots)]
+        if slot is not latest:
+            slot.pix[:] = latest.pix
+        slot.seq = self.count
+        slot.ticks = ticks
+        slot.sp_id = sp_id
+        slot.pattern_id = pattern_id
+        return slot
+
+    def commit(self):
+        # make the slot handed out by begin() the latest frame
+        self.head = (self.head + 1) % len(self.slots)
+        self.count += 1
+        return self.slots[self.head]
+
 
 ImageLimits = namedtuple('ScaleLimits', ('min_h', 'max_h', 'min_idx', 'max_idx'))
 
@@ -96,123 +302,243 @@ _INTERP_NEIGHBOURS = tuple(
     if row != 0 or col != 0
 )
 
-# class ProcessedImage:
-#     def __init__(self, calib):
-#         # pix_data should be a sequence of ints
-#         self.calib = calib
-#         self.v_ir = array_filled('f', IMAGE_SIZE, 0.0)
-#         self.alpha = array_filled('f', IMAGE_SIZE, 1.0)
-#         self.buf = array_filled('f', IMAGE_SIZE, 1.0)
-# 
-#     def update(self, pix_data, subpage, state):
-#         if self.calib.use_tgc:
-#             pix_os_cp = self._calc_os_cp(subpage, state)
-#             pix_alpha_cp = self.calib.pix_alpha_cp[subpage.id]
-# 
-#         for idx, raw in pix_data:
-#             ## IR data compensation - offset, Vdd, and Ta
-#             kta = self.calib.pix_kta[idx]
-# 
-#             row, col = divmod(idx, NUM_COLS)
-#             kv = self.calib.kv_avg[row % 2][col % 2]
-#             
-#             offset = self.calib.pix_os_ref[idx]
-#             offset *= (1 + kta*state.ta)*(1 + kv*state.vdd)
-# 
-#             v_os = raw*state.gain - offset
-#             if subpage.pattern is InterleavedPattern:
-#                 v_os += self.calib.il_offset[idx]
-#             v_ir = v_os / self.calib.emissivity
-# 
-#             ## IR data gradient compensation
-#             if self.calib.use_tgc:
-#                 v_ir -= self.calib.tgc*pix_os_cp
-# 
-#             # preserve v_ir for temperature calculations
-#             self.v_ir[idx] = v_ir
-# 
-#             alpha = self._calc_alpha(idx, state.ta)
-#             self.buf[idx] = v_ir/alpha
-# 
-#     def _calc_os_cp(self, subpage, state):
-#         pix_os_cp = self.calib.pix_os_cp[subpage.id]
-#         if subpage.pattern is InterleavedPattern:
-#             pix_os_cp += self.calib.il_chess_c1
-#         return state.gain_cp[subpage.id] - pix_os_cp*(1 + self.calib.kta_cp*state.ta)*(1 + self.calib.kv_cp*state.vdd)
-# 
-#     def _calc_os_cp2(self, pattern, state):
-#         pix_os_cp = list(self.calib.pix_os_cp)
-#         if pattern is InterleavedPattern:
-#             for i in range(len(pix_os_cp)):
-#                 pix_os_cp[i] += self.calib.il_chess_c1
-# 
-#         k = (1 + self.calib.kta_cp*state.ta)*(1 + self.calib.kv_cp*state.vdd)
-#         return [
-#             gain_cp_sp - pix_os_cp_sp*k
-#             for pix_os_cp_sp, gain_cp_sp in zip(pix_os_cp, state.gain_cp)
-#         ]
-# 
-#     def _calc_alpha(self, idx, ta):
-#         alpha = self.calib.pix_alpha[idx]
-#         if self.calib.use_tgc:
-#             alpha -= self.calib.tgc*pix_alpha_cp
-#         alpha *= (1 + self.calib.ksta*ta)
-#         return alpha
-# 
-#     def _calc_to(self, idx, alpha, ta_r):
-#         v_ir = self.v_ir[idx]
-# 
-#         s_x = v_ir*(alpha**3) + ta_r*(alpha**4)
-#         s_x = math.sqrt(math.sqrt(s_x))*self.calib.ksto[1]
-# 
-#         to = v_ir/(alpha*(1 - TEMP_K*self.calib.ksto[1]) + s_x) + ta_r
-#         to = math.sqrt(math.sqrt(to)) - TEMP_K
-#         return to + self.calib.drift
-# 
-#     def calc_temperature(self, idx, state):
-#         alpha = self._calc_alpha(idx, state.ta)
-#         return self._calc_to(idx, alpha, state.ta_r)
-# 
-#     def calc_temperature_ext(self, idx, state):
-#         v_ir = self.v_ir[idx]
-#         alpha = self._calc_alpha(idx, state.ta)
-#         to = self._calc_to(idx, alpha, state.ta_r)
-# 
-#         band = self._get_range_band(to)
-#         if band < 0:
-#             return self.calib.ct[0]
-# 
-#         alpha_ext = self.calib.alpha_ext[band]
-#         ksto_ext = self.calib.ksto[band]
-#         ct = self.calib.ct[band]
-#         to_ext = v_ir/(alpha*alpha_ext*(1 + ksto_ext*(to - ct))) + state.ta_r
-#         to_ext = math.sqrt(math.sqrt(to_ext)) - TEMP_K
-#         return to_ext  + self.calib.drift
-# 
-#     def _get_range_band(self, t):
-#         return sum(1 for ct in self.calib.ct if t >= ct) - 1
-# 
-#     def calc_limits(self, *, exclude_idx=()):
-#         # find min/max in place to keep mem usage down
-#         min_h, min_idx = None, None
-#         max_h, max_idx = None, None
-#         for idx, h in enumerate(self.buf):
-#             if idx in exclude_idx:
-#                 continue
-#             if min_h is None or h < min_h:
-#                 min_h, min_idx = h, idx
-#             if max_h is None or h > max_h:
-#                 max_h, max_idx = h, idx
-#         return ImageLimits(min_h, max_h, min_idx, max_idx)
-# 
-#     def interpolate_bad_pixels(self, bad_pixels):
-#         for bad_idx in bad_pixels:
-#             count = 0
-#             total = 0
-#             for offset in _INTERP_NEIGHBOURS:
-#                 idx = bad_idx + offset
-#                 if idx in range(IMAGE_SIZE) and idx not in bad_pixels:
-#                     count += 1
-#                     total += self.buf[idx]
-#             if count > 0:
-#                 self.buf[bad_idx] = total/count
+class BadPixelMap:
+    # pixels to be replaced by the mean of their good neighbours; the
+    # neighbour lists are flattened into index tables when the map changes,
+    # so apply() only touches the bad pixels and their neighbours
+    def __init__(self, bad=(), width=NUM_COLS, height=NUM_ROWS):
+        self.width = width
+        self.height = height
+        self._bad = set(bad)
+        self._build()
+
+    def __len__(self):
+        return len(self._bad)
+
+    def __contains__(self, idx):
+        return idx in self._bad
+
+    def add(self, *pixels):
+        count = len(self._bad)
+        self._bad.update(pixels)
+        if len(self._bad) != count:
+            self._build()
+
+    def _build(self):
+        width = self.width
+        pixels = sorted(self._bad)
+        neighbours = []
+        starts = [0]
+        for idx in pixels:
+            row, col = divmod(idx, width)
+            for d_row in (-1, 0, 1):
+                for d_col in (-1, 0, 1):
+                    r = row + d_row
+                    c = col + d_col
+                    if ((d_row or d_col) and 0 <= r < self.height
+                            and 0 <= c < width
+                            and r * width + c not in self._bad):
+                        neighbours.append(r * width + c)
+            starts.append(len(neighbours))
+        self.pixels = array('H', pixels)
+        self._starts = array('H', starts)
+        self._neighbours = array('H', neighbours)
+
+    def apply(self, pix):
+        # a pixel with no good neighbours is left as it is
+        starts = self._starts
+        neighbours = self._neighbours
+        for n in range(len(self.pixels)):
+            start = starts[n]
+            count = starts[n + 1] - start
+            if not count:
+                continue
+            total = 0
+            for k in range(start, start + count):
+                total += pix[neighbours[k]]
+            if isinstance(total, int):
+                pix[self.pixels[n]] = total // count
+            else:
+                pix[self.pixels[n]] = total / count
+
+class StuckPixelDetector:
+    # counts how many reads in a row each pixel has given exactly the same
+    # value, its first read included; live pixels always show a few counts
+    # of noise. update() can be given the table of pixels just read, e.g.
+    # one subpage, in which case per_frame says how many updates make up a
+    # frame, so that every pixel has been read frames times once done
+    def __init__(self, size=IMAGE_SIZE, frames=16, per_frame=1):
+        self.frames = frames
+        self.per_frame = per_frame
+        self.seen = 0
+        self._last = array_filled('h', size)
+        self._runs = bytearray(size)  # 0 until a pixel is first read
+
+    def update(self, pix, table=None):
+        last = self._last
+        runs = self._runs
+        for idx in table if table is not None else range(len(runs)):
+            value = pix[idx]
+            run = runs[idx]
+            if run and value == last[idx]:
+                if run < 255:
+                    runs[idx] = run + 1
+            else:
+                runs[idx] = 1
+                last[idx] = value
+        self.seen += 1
+
+    @property
+    def done(self):
+        return self.seen >= self.frames * self.per_frame
+
+    def stuck(self):
+        runs = self._runs
+        return tuple(idx for idx in range(len(runs))
+                     if runs[idx] >= self.frames)
+
+class ProcessedImage:
+    # Calibrated image. The offset tables are folded into one coefficient
+    # table of the image's own when it is created:
+    #   os_kta  os_ref * kta
+    # and calib's pix_os_ref and pix_alpha are used as they are, so that each
+    # subpage is compensated by update() in a single pass. calib is not
+    # changed, so it can be shared, saved again, or used for another image.
+    def __init__(self, calib):
+        self.calib = calib
+
+        self.os_ref = calib.pix_os_ref
+        self.os_kta = array('f', (calib.pix_kta[idx]*self.os_ref[idx]
+                                  for idx in range(IMAGE_SIZE)))
+        self.alpha = calib.pix_alpha
+
+        self.pattern = ChessPattern  # pattern of the last update
+        self.il_offset = None  # only built for the interleaved pattern
+        self.kv = array_filled('f', 4, 1.0)  # (1 + kv*vdd), by [row%2][col%2]
+        self.buf = array_filled('f', IMAGE_SIZE, 0.0)
+
+    def __getitem__(self, idx):
+        return self.buf[idx]
+
+    def update(self, pix, subpage, state):
+        # pix should be the raw pixel array; only the pixels of subpage are
+        # compensated
+        calib = self.calib
+        ta = state.ta
+        self.pattern = subpage.pattern
+
+        kv = self.kv
+        for row in range(2):
+            for col in range(2):
+                kv[row*2 + col] = 1 + calib.kv_avg[row][col]*state.vdd
+
+        il_offset = None
+        if subpage.pattern is InterleavedPattern:
+            if self.il_offset is None:
+                self.il_offset = array('f', calib.calc_il_offset())
+            il_offset = self.il_offset
+
+        # v_ir is the offset compensated value divided by the emissivity,
+        # which is folded into the one scale factor for the subpage
+        if calib.use_tgc:
+            cp_term = calib.emissivity*calib.tgc*self._calc_os_cp(subpage, state)
+            alpha_shift = calib.tgc*calib.pix_alpha_cp[subpage.id]
+        else:
+            cp_term = 0.0
+            alpha_shift = 0.0
+        ksta_inv = 1.0/((1 + calib.ksta*ta)*calib.emissivity)
+
+        gain = state.gain
+        os_ref = self.os_ref
+        os_kta = self.os_kta
+        alpha = self.alpha
+        buf = self.buf
+        for idx in subpage.sp_range():
+            ## IR data compensation - offset, Vdd, and Ta
+            v_os = pix[idx]*gain - (os_ref[idx] + os_kta[idx]*ta)*kv[(idx >> 4) & 2 | idx & 1]
+            if il_offset is not None:
+                v_os += il_offset[idx]
+
+            ## IR data gradient compensation and sensitivity normalization
+            buf[idx] = (v_os - cp_term)*ksta_inv/(alpha[idx] - alpha_shift)
+
+    def _calc_os_cp(self, subpage, state):
+        pix_os_cp = self.calib.pix_os_cp[subpage.id]
+        if subpage.pattern is InterleavedPattern:
+            pix_os_cp += self.calib.il_chess_c1
+        return state.gain_cp[subpage.id] - pix_os_cp*(1 + self.calib.kta_cp*state.ta)*(1 + self.calib.kv_cp*state.vdd)
+
+    def _calc_alpha(self, idx, ta):
+        # compensated sensitivity of one pixel
+        alpha = self.alpha[idx]
+        if self.calib.use_tgc:
+            sp_id = self.pattern.get_sp(idx)
+            alpha -= self.calib.tgc*self.calib.pix_alpha_cp[sp_id]
+        return alpha*(1 + self.calib.ksta*ta)
+
+    def _calc_to(self, v_ir, alpha, ta_r):
+        s_x = v_ir*(alpha**3) + ta_r*(alpha**4)
+        s_x = math.sqrt(math.sqrt(s_x))*self.calib.ksto[1]
+
+        to = v_ir/(alpha*(1 - TEMP_K*self.calib.ksto[1]) + s_x) + ta_r
+        to = math.sqrt(math.sqrt(to)) - TEMP_K
+        return to + self.calib.drift
+
+    def calc_temperature(self, idx, state):
+        alpha = self._calc_alpha(idx, state.ta)
+        v_ir = self.buf[idx]*alpha
+        return self._calc_to(v_ir, alpha, state.ta_r)
+
+    def calc_temperature_ext(self, idx, state):
+        alpha = self._calc_alpha(idx, state.ta)
+        v_ir = self.buf[idx]*alpha
+        to = self._calc_to(v_ir, alpha, state.ta_r)
+
+        band = self._get_range_band(to)
+        if band < 0:
+            return self.calib.ct[0]
+
+        alpha_ext = self.calib.alpha_ext[band]
+        ksto_ext = self.calib.ksto[band]
+        ct = self.calib.ct[band]
+        to_ext = v_ir/(alpha*alpha_ext*(1 + ksto_ext*(to - ct))) + state.ta_r
+        to_ext = math.sqrt(math.sqrt(to_ext)) - TEMP_K
+        return to_ext  + self.calib.drift
+
+    def _get_range_band(self, t):
+        return sum(1 for ct in self.calib.ct if t >= ct) - 1
+
+    def calc_limits(self, *, exclude_idx=()):
+        # find min/max in place to keep mem usage down
+        min_h, min_idx = None, None
+        max_h, max_idx = None, None
+        for idx, h in enumerate(self.buf):
+            if idx in exclude_idx:
+                continue
+            if min_h is None or h < min_h:
+                min_h, min_idx = h, idx
+            if max_h is None or h > max_h:
+                max_h, max_idx = h, idx
+        return ImageLimits(min_h, max_h, min_idx, max_idx)
+
+
+if __name__ == "__main__":
+    # Check that the stuck pixel detector finds a stuck pixel in each subpage
+    # when it is fed one subpage at a time, in either order; run it from src
+    # with "python -m mlx90640.image" on a host.
+    pix = array_filled('h', IMAGE_SIZE)
+    tables = (ChessPattern.sp_range(0), ChessPattern.sp_range(1))
+    stuck = (tables[0][100], tables[1][200])
+    for first in (0, 1):
+        detector = StuckPixelDetector(frames=16, per_frame=2)
+        n = 0
+        while not detector.done:
+            sp_id = (first + n) % 2
+            for idx in tables[sp_id]:
+                # Live pixels never read the same twice in a row
+                pix[idx] = 1234 if idx in stuck else 600 + n % 3 + idx % 5
+            detector.update(pix, tables[sp_id])
+            n += 1
+        found = detector.stuck()
+        print(f"subpage {first} first: {n} subpages read, stuck {found}, "
+              f"{'ok' if found == tuple(sorted(stuck)) else 'WRONG'}")
@@ -2,11 +2,11 @@
 """
 
 from mlx90640.utils import (
+    const,
     field_desc,
     FieldDesc,
     FD_BYTE,
     FD_WORD,
-    Struct,
     StructProto,
 )
 
@@ -49,6 +49,10 @@ REGISTER_MAP = {
     0x072A : field_desc('vdd_pix',      FD_WORD, signed=True),
 }
 
+# Registers which the camera itself updates; these are never cached unless
+# explicitly refreshed
+VOLATILE_REGISTERS = (0x8000, 0x0700, 0x0708, 0x070A, 0x0720, 0x0728, 0x072A)
+
 # Calibration Data
 EEPROM_ADDRESS = const(0x2400)
 EEPROM_SIZE    = const(0x340)
@@ -154,12 +158,29 @@ class CameraInterface:
 
 class ReadOnlyError(Exception): pass
 
+# largest run of unused addresses read through to merge two bursts into one
+_MAX_GAP = const(4)
+
 class RegisterMap:
-    def __init__(self, iface, register_map, readonly=False):
+    def __init__(self, iface, register_map, readonly=False, *,
+                 cache=False, volatile=()):
         # register_map should be a dict of { I2C address : FieldDesc(s) }
+        # with cache set, register contents are shadowed in RAM: static
+        # registers are read once, volatile ones only hold a value between an
+        # explicit refresh() and the next invalidate()
         self.iface = iface
         self.readonly = readonly
+        self.cache = cache
         self._fields = self._build_lookup(register_map)
+        self._addresses = tuple(sorted(register_map))
+        self._volatile = set(volatile)
+        self._shadow = {}  # register words, by address
+        self._dirty = None
+        self._buf = bytearray(REG_SIZE)
+        # scratch space for burst reads, big enough for the longest merged
+        # span; views of it are kept by length so polling doesn't allocate
+        self._scratch = bytearray(self._longest_span() * REG_SIZE)
+        self._views = {}
 
     @staticmethod
     def _build_lookup(register_map):
@@ -176,6 +197,18 @@ class RegisterMap:
 
         return lookup
 
+    def _longest_span(self):
+        # any subset of the addresses merges into spans within these ones
+        addresses = self._addresses
+        longest = start = 0
+        for idx in range(1, len(addresses) + 1):
+            if (idx < len(addresses)
+                    and addresses[idx] - addresses[idx - 1] <= _MAX_GAP):
+                continue
+            longest = max(longest, addresses[idx - 1] - addresses[start] + 1)
+            start = idx
+        return longest
+
     def __iter__(self):
         return iter(self.keys())
     def __len__(self):
@@ -185,10 +218,7 @@ class RegisterMap:
 
     def __getitem__(self, name):
         address, proto = self._fields[name]
-
-        buf = self.iface.read(address)
-        struct = Struct(buf, proto)
-        return struct[name]
+        return proto.decode(name, self._load(address))
 
     def __setitem__(self, name, value):
         if self.readonly:
@@ -196,8 +226,178 @@ class RegisterMap:
 
         address, proto = self._fields[name]
 
-        buf = bytearray(REG_SIZE)
+        word = self._shadow.get(address)
+        if word is None:
+            word = self._read_word(address)
+        word = proto.encode(name, word, value)
+
+        if self._dirty is not None:
+            self._shadow[address] = word
+            self._dirty.add(address)
+            return
+
+        self._write_word(address, word)
+        if (self.cache and address not in self._volatile
+                or address in self._shadow):
+            self._shadow[address] = word
+
+    def _load(self, address):
+        word = self._shadow.get(address)
+        if word is not None:
+            return word
+
+        if self.cache and self.readonly:
+            # nothing can change a read-only map; fetch all of it at once
+            self.refresh()
+            return self._shadow[address]
+
+        word = self._read_word(address)
+        if self.cache and address not in self._volatile:
+            self._shadow[address] = word
+        return word
+
+    def _read_word(self, address):
+        buf = self._buf
         self.iface.read_into(address, buf)
-        struct = Struct(buf, proto)
-        struct[name] = value
+        return buf[0] << 8 | buf[1]
+
+    def _write_word(self, address, word):
+        buf = self._buf
+        buf[0] = word >> 8
+        buf[1] = word & 0xFF
         self.iface.write(address, buf)
+
+    def _addresses_of(self, names):
+        if not names:
+            return self._addresses
+        return sorted(set(self._fields[name][0] for name in names))
+
+    ## shadow cache control
+
+    def set_volatile(self, name, volatile=True):
+        address, _ = self._fields[name]
+        if volatile:
+            self._volatile.add(address)
+            self._shadow.pop(address, None)
+        else:
+            self._volatile.discard(address)
+
+    def refresh(self, *names):
+        """ Read the registers holding the given fields (all of them if none
+        are given) into the shadow cache, merging nearby addresses into as few
+        burst reads as possible.
+        """
+        addresses = self._addresses_of(names)
+        start = 0
+        for idx in range(1, len(addresses) + 1):
+            if (idx < len(addresses)
+                    and addresses[idx] - addresses[idx - 1] <= _MAX_GAP):
+                continue
+            self._read_span(addresses, start, idx)
+            start = idx
+
+    def _read_span(self, addresses, start, stop):
+        base = addresses[start]
+        length = (addresses[stop - 1] - base + 1) * REG_SIZE
+        span = self._views.get(length)
+        if span is None:
+            span = self._views[length] = memoryview(self._scratch)[:length]
+        self.iface.read_into(base, span)
+        for idx in range(start, stop):
+            offset = (addresses[idx] - base) * REG_SIZE
+            self._shadow[addresses[idx]] = span[offset] << 8 | span[offset + 1]
+
+    def load(self, base, data):
+        """ Fill the shadow cache from a block of register contents which has
+        already been read, starting at address base.
+        """
+        end = base + len(data) // REG_SIZE
+        self._store(base, data, tuple(
+            address for address in self._addresses if base <= address < end
+        ))
+
+    def _store(self, base, data, addresses):
+        for address in addresses:
+            offset = (address - base) * REG_SIZE
+            self._shadow[address] = data[offset] << 8 | data[offset + 1]
+
+    def invalidate(self, *names):
+        """ Drop the shadowed registers holding the given fields (all of them
+        if none are given) so that the next access reads the bus again.
+        """
+        if self._dirty:
+            raise RuntimeError("can't invalidate while writes are deferred")
+        for address in self._addresses_of(names):
+            self._shadow.pop(address, None)
+
+    def deferred(self):
+        """ Context manager which collects field writes in the shadow cache
+        and writes each modified register once on exit.
+        """
+        return _DeferredWrites(self)
+
+    def flush(self):
+        dirty, self._dirty = self._dirty, None
+        for address in sorted(dirty or ()):
+            self._write_word(address, self._shadow[address])
+            if not self.cache or address in self._volatile:
+                del self._shadow[address]
+
+
+class _DeferredWrites:
+    def __init__(self, regmap):
+        self.regmap = regmap
+        self.outer = False
+
+    def __enter__(self):
+        # only the outermost block flushes
+        self.outer = self.regmap._dirty is None
+        if self.outer:
+            self.regmap._dirty = set()
+        return self.regmap
+
+    def __exit__(self, *exc_info):
+        if self.outer:
+            self.regmap.flush()
+
+
+if __name__ == "__main__":
+    # Benchmark field access against an in-memory register file; this runs
+    # on a host under CPython as well as on the board.
+    from mlx90640.utils import ticks_us, ticks_diff
+
+    class _MemoryInterface:
+        def __init__(self):
+            self.words = {0x8000: 0x0009, 0x800D: 0x1901}
+            self.transactions = 0
+        def read(self, mem_addr):
+            buf = bytearray(REG_SIZE)
+            self.read_into(mem_addr, buf)
+            return buf
+        def read_into(self, mem_addr, buf):
+            self.transactions += 1
+            for idx in range(len(buf) // REG_SIZE):
+                word = self.words.get(mem_addr + idx, 0)
+                buf[idx*REG_SIZE] = word >> 8
+                buf[idx*REG_SIZE + 1] = word & 0xFF
+        def write(self, mem_addr, buf):
+            self.transactions += 1
+            self.words[mem_addr] = buf[0] << 8 | buf[1]
+
+    runs = 1000
+    for cache in (False, True):
+        iface = _MemoryInterface()
+        regs = RegisterMap(iface, REGISTER_MAP, cache=cache,
+                           volatile=VOLATILE_REGISTERS)
+        t_start = ticks_us()
+        for n in range(runs):
+            if cache:
+                regs.refresh('data_available')
+            has_data = regs['data_available']
+            last_subpage = regs['last_subpage']
+            pattern = regs['read_pattern']
+        per_poll = ticks_diff(ticks_us(), t_start) / runs
+        print(f"cache={cache}: {per_poll:.1f} us and "
+              f"{iface.transactions / runs:.1f} transactions per status poll "
+              f"(data_available={has_data}, last_subpage={last_subpage}, "
+              f"read_pattern={pattern})")
@@ -1,18 +1,32 @@
 """ Buffer carving utilties.
+
+Register fields are decoded from 16-bit words with plain shifts and masks,
+so this module (and the register layer built on it) also runs on CPython.
 """
 
 from array import array
-from ucollections import namedtuple
-from uctypes import (
-    INT8, UINT8,
-    INT16, UINT16,
-    BFUINT16,
-    BF_POS,
-    BF_LEN,
-    BIG_ENDIAN,
-    addressof,
-    struct as uc_struct,
-)
+try:
+    from ucollections import namedtuple
+except ImportError:
+    from collections import namedtuple
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+try:
+    from utime import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter
+    def ticks_us():
+        return int(perf_counter() * 1_000_000)
+    def ticks_diff(end, start):
+        return end - start
+try:
+    from gc import mem_free
+except ImportError:
+    def mem_free():
+        return 0  # not reported by CPython
 
 def array_filled(typecode, length, fill=0):
     return array(typecode, (fill for i in range(length)))
@@ -27,45 +41,53 @@ def twos_complement(bits, value):
 FD_BYTE = object()
 FD_WORD = object()
 
-FieldDesc = namedtuple('FieldDesc', ('name', 'layout', 'signed_bits'))
+# a field is decoded from its register word as (word >> shift) & mask, then
+# sign-extended from signed_bits if that is not None
+FieldDesc = namedtuple('FieldDesc', ('name', 'shift', 'mask', 'signed_bits'))
 def field_desc(name, bits, pos=0, signed=False):
     if bits is FD_WORD:
-        layout = 0 | (INT16 if signed else UINT16)
-        return FieldDesc(name, layout, None)
-    
+        return FieldDesc(name, 0, 0xFFFF, 16 if signed else None)
+
     if bits is FD_BYTE:
-        layout = pos | (INT8 if signed else UINT8)
-        return FieldDesc(name, layout, None)
+        # pos is the byte offset within the big-endian word
+        shift = 8 if pos == 0 else 0
+        return FieldDesc(name, shift, 0xFF, 8 if signed else None)
 
-    layout = 0 | BFUINT16 | pos << BF_POS | bits << BF_LEN
-    return FieldDesc(name, layout, bits if signed else None)
+    return FieldDesc(name, pos, (1 << bits) - 1, bits if signed else None)
 
 
 class StructProto:
-    # data needed to create a Struct
+    # data needed to decode the fields of one register
     # can be instantiated once and reused between Struct instances
     def __init__(self, fields):
-        self.layout = {}
-        self.signed = {}
+        self.fields = {}
         for fld in fields:
-            self.layout[fld.name] = fld.layout
-            if fld.signed_bits is not None:
-                self.signed[fld.name] = fld.signed_bits
+            self.fields[fld.name] = fld
+
+    def decode(self, name, word):
+        fld = self.fields[name]
+        value = (word >> fld.shift) & fld.mask
+        if fld.signed_bits is not None:
+            return twos_complement(fld.signed_bits, value)
+        return value
+
+    def encode(self, name, word, value):
+        # returns word with the field replaced by value
+        fld = self.fields[name]
+        mask = fld.mask << fld.shift
+        return (word & ~mask) | ((value << fld.shift) & mask)
 
 class Struct:
+    # view of the fields of a big-endian register held in a 2-byte buffer
     def __init__(self, buf, proto):
-        self._signed = proto.signed
-        self._struct = uc_struct(addressof(buf), proto.layout, BIG_ENDIAN)
+        self._buf = buf
+        self._proto = proto
 
     def __getitem__(self, name):
-        value = getattr(self._struct, name)
-        signed = self._signed.get(name)
-        if signed is not None:
-            return twos_complement(signed, value)
-        return value
+        return self._proto.decode(name, self._buf[0] << 8 | self._buf[1])
 
     def __setitem__(self, name, value):
-        signed = self._signed.get(name)
-        if signed is not None:
-            value = twos_complement(signed, value)
-        setattr(self._struct, name, value)
+        word = self._buf[0] << 8 | self._buf[1]
+        word = self._proto.encode(name, word, value)
+        self._buf[0] = word >> 8
+        self._buf[1] = word & 0xFF
@@ -25,11 +25,33 @@ example.
 """
 
 import gc
-import utime as time
-from machine import Pin, I2C
+import sys
+try:
+    import utime as time
+    from machine import Pin, I2C
+except ImportError:
+    # Not on a board, probably on a host with an emulated camera
+    import time
 from mlx90640 import MLX90640
 from mlx90640.calibration import NUM_ROWS, NUM_COLS, IMAGE_SIZE, TEMP_K
-from mlx90640.image import ChessPattern, InterleavedPattern
+from mlx90640.image import (ChessPattern, InterleavedPattern, Roi,
+                            BadPixelMap, StuckPixelDetector)
+from targeting import make_accumulator, hot_column, locate
+from background import BackgroundModel
+
+
+def _stdout():
+    """!
+    @brief   The binary stream behind standard output, if there is one.
+    """
+    return getattr(sys.stdout, 'buffer', sys.stdout)
+
+
+def _pixels(array):
+    """!
+    @brief   The pixel values of an image object, or the array itself.
+    """
+    return getattr(array, 'pix', None) or getattr(array, 'buf', array)
 
 
 class MLX_Cam:
@@ -38,8 +60,17 @@ class MLX_Cam:
              make it easier to grab and use an image.
     """
 
+    ## Acquisition state in which no image is being taken
+    S0_IDLE = 0
+    ## Acquisition state waiting for the camera to have a subpage ready
+    S1_WAIT = 1
+    ## Acquisition state reading a subpage a few rows at a time
+    S2_READ = 2
+
     def __init__(self, i2c, address=0x33, pattern=ChessPattern,
-                 width=NUM_COLS, height=NUM_ROWS):
+                 width=NUM_COLS, height=NUM_ROWS, rows_per_step=2,
+                 frames=1, calibrated=False, background=False,
+                 half_frames=False, bad_pixels=False):
         """!
         @brief   Set up an MLX90640 camera.
         @param   i2c An I2C bus which has been set up to talk to the camera;
@@ -49,6 +80,24 @@ class MLX_Cam:
                  the pixels at a time (default ChessPattern)
         @param   width The width of the image in pixels; leave it at default
         @param   height The height of the image in pixels; leave it at default
+        @param   rows_per_step How many rows of pixels each call to
+                 @c step_image() reads from the camera
+        @param   frames How many recent frames the camera driver keeps in its
+                 frame ring, each with its capture time and sequence number
+        @param   calibrated If @c True, images are compensated with the
+                 camera's calibration data so pixel values no longer drift
+                 with ambient temperature and pixel gain; this takes more
+                 memory and time than raw images
+        @param   background If @c True, a running background of the scene is
+                 learned from raw images, and @c foreground holds each image
+                 minus its background; not available with @c calibrated
+        @param   half_frames If @c True, each acquisition reads just the next
+                 subpage the camera has ready and merges it into the previous
+                 image, so updated images arrive twice as often
+        @param   bad_pixels If @c True, the pixels which the camera's EEPROM
+                 flags as bad are replaced by the average of their neighbours
+                 in calibrated images and in the foreground; raw images are
+                 always left as read. See also @c watch_stuck_pixels()
         """
         ## The I2C bus to which the camera is attached
         self._i2c = i2c
@@ -61,16 +110,60 @@ class MLX_Cam:
         ## The height of the image in pixels, which should be 24
         self._height = height
 
+        ## Whether images are calibrated rather than raw
+        self._calibrated = calibrated
+        ## Whether each acquisition reads one subpage rather than both
+        self._half_frames = half_frames
+        if background and calibrated:
+            raise ValueError("The background is only learned from raw images")
+
         # The MLX90640 object that does the work
         self._camera = MLX90640(i2c, address)
         self._camera.set_pattern(pattern)
-        self._camera.setup()
+        self._camera.setup(frames=frames, calibrated=calibrated,
+                           bad_pixels=bad_pixels)
 
         ## A local reference to the image object within the camera driver
-        self._image = self._camera.raw
-
-
-    def ascii_image(self, array, pixel="██", textcolor="0;180;0"):
+        self._image = self._camera.image if calibrated else self._camera.raw
+
+        ## How many rows of pixels are read per acquisition step
+        self._rows_per_step = rows_per_step
+        ## The current state of the non-blocking image acquisition
+        self._state = MLX_Cam.S0_IDLE
+        ## The subpage (0 or 1) currently being acquired
+        self._subpage = 0
+        ## How many rows of the current subpage have been read
+        self._row = 0
+        ## Function called with the image when an acquisition completes
+        self._callback = None
+        ## Detector looking for stuck pixels, if one has been started
+        self._stuck = None
+
+        ## Escape codes for each shade of @c ascii_image(), and the settings
+        #  they were made for; made when first needed
+        self._shade_key = None
+        self._shades = None
+        self._row_end = None
+        self._row_buf = None
+        ## Reusable buffer for one row of @c ascii_art()
+        self._art_buf = bytearray(2 * width + 1)
+        ## Reusable list of one row's values for CSV, and the format which
+        #  turns them into a line in one go
+        self._csv_vals = [0] * width
+        self._csv_fmt = "%d," * (width - 1) + "%d"
+
+        ## Preallocated column and row sums for @c get_hot_column() and
+        #  @c locate_target(); calibrated images hold floating point values
+        self._col_acc = make_accumulator(width, 'f' if calibrated else 'l',
+                                         height)
+
+        ## Model of the static scene, updated as each subpage is read
+        self._background = (BackgroundModel(width * height) if background
+                            else None)
+
+
+    def ascii_image(self, array, pixel="██", textcolor="0;180;0", stream=None,
+                    levels=256):
         """!
         @brief   Show low-resolution camera data as shaded pixels on a text
                  screen.
@@ -89,7 +182,14 @@ class MLX_Cam:
                  A simple auto-brightness scaling is done, setting the lowest
                  brightness of a filled block to 0 and the highest to 255. If
                  there are bad pixels, this can reduce contrast in the rest of
-                 the image.
+                 the image; they are only corrected in calibrated images and
+                 the foreground, see @c watch_stuck_pixels().
+
+                 Each row is put together in a reusable buffer from a table of
+                 precomputed escape codes, one for each of @c levels shades,
+                 and written all at once. With the default 256 levels the
+                 output is the same as printing each pixel on its own; fewer
+                 levels make a smaller table.
 
                  After the printing is done, character color is reset to a
                  default of medium-brightness green, or something else if
@@ -101,70 +201,124 @@ class MLX_Cam:
                  image has been finished, as a string "<r>;<g>;<b>" with each
                  letter representing the intensity of red, green, and blue from
                  0 to 255
+        @param   stream Where to write the image, by default standard output
+        @param   levels How many shades of gray to use, 2 to 256 (default 256)
         """
-        minny = min(array)
-        scale = 255.0 / (max(array) - minny)
+        key = (pixel, textcolor, levels)
+        if self._shade_key != key:
+            # Escape code and pixel for each shade, then the end of a row
+            pix_bytes = pixel.encode()
+            self._shades = tuple(
+                f"\033[38;2;{v};{v};{v}m".encode() + pix_bytes
+                for v in (n * 255 // (levels - 1) for n in range(levels)))
+            self._row_end = f"\033[38;2;{textcolor}m\n".encode()
+            self._shade_key = key
+            self._row_buf = bytearray(
+                self._width * len(self._shades[-1]) + len(self._row_end))
+        shades = self._shades
+        row_end = self._row_end
+        buf = self._row_buf
+        out = memoryview(buf)
+        stream = stream or _stdout()
+        data = _pixels(array)
+
+        minny = min(data)
+        span = max(data) - minny
+        scale = (levels - 1) / span if span else 0
         for row in range(self._height):
+            pos = 0
+            idx = row * self._width + self._width - 1
             for col in range(self._width):
-                pix = int((array[row * self._width + (self._width - col - 1)]
-                           - minny) * scale)
-                print(f"\033[38;2;{pix};{pix};{pix}m{pixel}", end='')
-            print(f"\033[38;2;{textcolor}m")
+                entry = shades[int((data[idx] - minny) * scale)]
+                idx -= 1
+                end = pos + len(entry)
+                buf[pos:end] = entry
+                pos = end
+            end = pos + len(row_end)
+            buf[pos:end] = row_end
+            stream.write(out[:end])
 
 
     ## A "standard" set of characters of different densities to make ASCII art
     asc = " -.:=+*#%@"
+    ## Each character of @c asc doubled, then the code shown for values past
+    #  the top of the scale
+    _asc_pairs = tuple((c + c).encode() for c in asc) + (b"><",)
 
 
-    def ascii_art(self, array):
+    def ascii_art(self, array, stream=None):
         """!
         @brief   Show a data array from the IR image as ASCII art.
         @details Each character is repeated twice so the image isn't squished
                  laterally. A code of "><" indicates an error, probably caused
-                 by a bad pixel in the camera. 
+                 by a bad pixel in the camera. Each row is put together in a
+                 reusable buffer and written all at once.
         @param   array The array to be shown, probably @c image.v_ir
+        @param   stream Where to write the image, by default standard output
         """
-        scale = len(MLX_Cam.asc) / (max(array) - min(array))
-        offset = -min(array)
+        pairs = MLX_Cam._asc_pairs
+        top = len(pairs) - 1
+        buf = self._art_buf
+        stream = stream or _stdout()
+        data = _pixels(array)
+
+        minny = min(data)
+        scale = len(MLX_Cam.asc) / (max(data) - minny)
         for row in range(self._height):
-            line = ""
+            pos = 0
+            idx = row * self._width + self._width - 1
             for col in range(self._width):
-                pix = int((array[row * self._width + (self._width - col - 1)]
-                           + offset) * scale)
-                try:
-                    the_char = MLX_Cam.asc[pix]
-                    print(f"{the_char}{the_char}", end='')
-                except IndexError:
-                    print("><", end='')
-            print('')
+                level = int((data[idx] - minny) * scale)
+                idx -= 1
+                pair = pairs[level if level < top else top]
+                buf[pos] = pair[0]
+                buf[pos + 1] = pair[1]
+                pos += 2
+            buf[pos] = 10  # newline
+            stream.write(buf)
         return
     
-    def get_hot_column(self, array):
+    def get_hot_column(self, array, even_bias=175, odd_bias=0):
         """!
         @brief   Calculate which column in the camera has the highest average value.
         @details For use with the nerf turret, this function will calculate which
                  column the opponent is likely in by adding up the pixel values for
                  the top half of the camera's image. This is because with the camera
                  on the table, the person shall only be visible in the top half or
-                 so of rows.
-        @param   array The array to be shown, probably @c image.v_ir
+                 so of rows. The sums are done with integers by the kernel in
+                 @c targeting.py, without allocating memory.
+        @param   array The image to be searched, probably @c image.v_ir
+        @param   even_bias A bias added to even columns, in tenths of one of
+                 the 10 brightness levels of @c ascii_art()
+        @param   odd_bias A bias added to odd columns, in the same units
         @return  maxIdx The hottest column, 0-31.
         """
-        scale = len(MLX_Cam.asc) / (max(array) - min(array))
-        offset = -min(array)
-        averages = [0] * 32
-        for row in range(12):
-            for col in range(self._width):
-                pix = int((array[row * self._width + (self._width - col - 1)]
-                           + offset) * scale)
-                averages[col] += pix
-        for col in range(32):
-            if col%2 == 0:
-                averages[col] += 17.5
+        pix = _pixels(array)
+        return hot_column(pix, self._col_acc, self._width, self._height // 2,
+                          even_bias, odd_bias, len(MLX_Cam.asc),
+                          native=not self._calibrated)
 
-        maxVal = max(averages)
-        maxIdx = averages.index(maxVal)
-        return maxIdx
+
+    def locate_target(self, array):
+        """!
+        @brief   Find where the opponent is in an image, to a fraction of a
+                 pixel.
+        @details Searches the top half of the image like @c get_hot_column(),
+                 then finds the hot region's centre in both directions. Only
+                 the columns of the region of interest are searched, if one
+                 is set. See @c targeting.locate().
+        @param   array The image to be searched
+        @return  A tuple of the row and column of the target, where column 0
+                 is the same as in @c get_hot_column(), and a confidence from
+                 0 (nothing stands out) to 1
+        """
+        pix = _pixels(array)
+        # Only the region of interest's columns hold fresh data
+        roi = self._camera.roi
+        return locate(pix, self._col_acc, self._width, self._height,
+                      self._height // 2, not self._calibrated,
+                      roi.col_start if roi else 0,
+                      roi.col_stop if roi else self._width)
 
 
     def get_csv(self, array, limits=None):
@@ -172,27 +326,53 @@ class MLX_Cam:
         @brief   Generate a string containing image data in CSV format.
         @details This function generates a set of lines, each having one row of
                  image data in Comma Separated Variable format. The lines can
-                 be printed or saved to a file using a @c for loop.
+                 be printed or saved to a file using a @c for loop. Each line
+                 is made from a reusable list of the row's values with one
+                 string format operation.
+        @param   array The array of data to be presented
+        @param   limits A 2-iterable containing the maximum and minimum values
+                 to which the data should be scaled, or @c None for no scaling
+        """
+        return self._csv_lines(array, limits, self._csv_fmt)
+
+
+    def write_csv(self, array, stream=None, limits=None):
+        """!
+        @brief   Write image data in CSV format, one line per row.
+        @details Same as printing the lines from @c get_csv(), but each line
+                 is written with its newline in one call.
         @param   array The array of data to be presented
+        @param   stream Where to write the data, such as a file opened in
+                 binary mode; by default standard output
         @param   limits A 2-iterable containing the maximum and minimum values
                  to which the data should be scaled, or @c None for no scaling
         """
+        stream = stream or _stdout()
+        for line in self._csv_lines(array, limits, self._csv_fmt + "\n"):
+            stream.write(line.encode())
+
+
+    def _csv_lines(self, array, limits, fmt):
+        """!
+        @brief   Format each row of an image as a line of CSV.
+        @param   fmt The format for one line, with a @c %d for each column
+        @returns A generator of the lines, as strings
+        """
+        data = _pixels(array)
         if limits and len(limits) == 2:
-            scale = (limits[1] - limits[0]) / (max(array) - min(array))
-            offset = limits[0] - min(array)
+            scale = (limits[1] - limits[0]) / (max(data) - min(data))
+            offset = limits[0] - min(data)
         else:
             offset = 0.0
             scale = 1.0
+        vals = self._csv_vals
         for row in range(self._height):
-            line = ""
+            idx = row * self._width + self._width - 1
             for col in range(self._width):
-                pix = int((array[row * self._width + (self._width - col - 1)]
-                          + offset) * scale)
-                if col:
-                    line += ","
-                line += f"{pix}"
-            yield line
-        return
+                vals[col] = int((data[idx] + offset) * scale)
+                idx -= 1
+            yield fmt % tuple(vals)
+
 
     def get_image(self):
         """!
@@ -202,17 +382,244 @@ class MLX_Cam:
                  grabbed and combined (maybe; this is the raw version, so the
                  combination is sketchy and not fully tested). It is assumed
                  that the camera is in the ChessPattern (default) mode as it
-                 probably should be.
+                 probably should be. This function blocks until the image is
+                 complete; see @c start_image() for a version which doesn't.
         @returns A reference to the image object we've just filled with data
         """
-        for subpage in (0, 1):
-            while not self._camera.has_data:
-                #time.sleep_ms(50)
-                #print('.', end='')
-                pass
-            image = self._camera.read_image(subpage)
+        self.start_image()
+        while not self.step_image():
+            pass
+
+        return self._image
+
+
+    def start_image(self, callback=None):
+        """!
+        @brief   Begin taking an image without waiting for it.
+        @details The image is acquired by calling @c step_image() repeatedly,
+                 for example between runs of a control loop; each call only
+                 checks the camera's status or reads a few rows of pixels.
+        @param   callback A function which is called with the image as its
+                 only argument when the image is complete, or @c None
+        """
+        self._callback = callback
+        self._subpage = 0
+        self._row = 0
+        self._state = MLX_Cam.S1_WAIT
+
+
+    def step_image(self):
+        """!
+        @brief   Advance the acquisition started by @c start_image() by one
+                 step.
+        @details In the waiting state the camera's status register is checked
+                 once; when the camera has the needed subpage ready, the next
+                 @c rows_per_step rows of it are read. When the second subpage
+                 has been read the image is complete, the callback (if any)
+                 is called, and the camera goes back to idle. In half frame
+                 mode whichever subpage is ready is read, and the image is
+                 complete as soon as it has been merged in.
+        @returns @c True if this step completed the image, @c False if not
+        """
+        if self._state == MLX_Cam.S1_WAIT:
+            if not self._camera.has_data:
+                return False
+            self._camera.start_read(None if self._half_frames
+                                    else self._subpage)
+            # Rows above the region of interest have nothing to read
+            roi = self._camera.roi
+            self._row = roi.row_start if roi is not None else 0
+            self._state = MLX_Cam.S2_READ
+
+        if self._state == MLX_Cam.S2_READ:
+            self._row += self._rows_per_step
+            if not self._camera.read_rows(self._row):
+                return False
+            self._camera.finish_read()
+            if self._background is not None:
+                self._background.update(self._camera.raw.pix,
+                                        self._camera.read_table())
+                if self._camera.bad_pixels is not None:
+                    self._camera.bad_pixels.apply(self._background.fg)
+            if self._stuck is not None:
+                self._check_stuck()
+            if self._calibrated:
+                self._camera.process_image()
+
+            if self._subpage == 0 and not self._half_frames:
+                self._subpage = 1
+                self._state = MLX_Cam.S1_WAIT
+                return False
+
+            self._state = MLX_Cam.S0_IDLE
+            if not self._calibrated:
+                self._image = self._camera.raw
+            if self._callback is not None:
+                self._callback(self._image)
+            return True
+
+        return False
+
+
+    def set_roi(self, rows=None, cols=None):
+        """!
+        @brief   Read only a window of the image from now on.
+        @details Only the pixels inside the region of interest are read from
+                 the camera, and each row is read only across its columns, so
+                 images take less time in proportion to the window's size.
+                 Pixels outside the window keep their last values.
+        @param   rows A 2-tuple of the first row and one past the last row to
+                 read, or @c None for all rows
+        @param   cols A 2-tuple of the first column and one past the last
+                 column to read, numbered as in @c get_hot_column(), or
+                 @c None for all columns
+        """
+        row_start, row_stop = rows or (0, self._height)
+        col_start, col_stop = cols or (0, self._width)
+        # Columns are mirrored in memory
+        mem_start = self._width - col_stop
+        mem_stop = self._width - col_start
+        if self._camera.roi is None:
+            self._camera.roi = Roi(row_start, row_stop, mem_start, mem_stop)
+        else:
+            self._camera.roi.set(row_start, row_stop, mem_start, mem_stop)
+
+
+    def follow_target(self, column, margin=5, rows=None):
+        """!
+        @brief   Narrow the region of interest to the columns around a target.
+        @details Meant to be called with the tracker's estimate after each
+                 image, so that the next image reads only where the target
+                 can be. Call @c set_roi() with no columns to widen it again,
+                 for instance when the target has been lost.
+        @param   column The target's column, numbered as in
+                 @c get_hot_column(); it may be fractional
+        @param   margin How many columns to read on either side of it
+        @param   rows A 2-tuple of the rows to read, or @c None for all rows
+        """
+        centre = int(column + 0.5)
+        col_start = max(0, centre - margin)
+        col_stop = min(self._width, centre + margin + 1)
+        self.set_roi(rows, (col_start, col_stop))
+
+
+    def watch_stuck_pixels(self, frames=16):
+        """!
+        @brief   Look for stuck pixels in the next few images.
+        @details Pixels which read exactly the same raw value in every one of
+                 the next @c frames images are added to the camera driver's
+                 bad pixel map, joining any flagged in the EEPROM, and are
+                 replaced by the average of their neighbours from then on in
+                 calibrated images and in the foreground. Live pixels always
+                 show a little noise, so this can be done while the view is
+                 still.
+        @param   frames How many images in a row a pixel must be stuck for
+        """
+        if self._camera.bad_pixels is None:
+            self._camera.bad_pixels = BadPixelMap(width=self._width,
+                                                  height=self._height)
+        self._stuck = StuckPixelDetector(self._width * self._height,
+                                         frames, 2)
+
+
+    def _check_stuck(self):
+        """!
+        @brief   Feed the subpage just read to the stuck pixel detector, and
+                 add what it found to the bad pixel map once it has seen
+                 enough.
+        """
+        self._stuck.update(self._camera.raw.pix, self._camera.read_table())
+        if self._stuck.done:
+            stuck = self._stuck.stuck()
+            self._stuck = None
+            self._camera.bad_pixels.add(*stuck)
+
+
+    @property
+    def busy(self):
+        """!
+        @brief   Whether an image acquisition is in progress.
+        """
+        return self._state != MLX_Cam.S0_IDLE
+
+
+    @property
+    def progress(self):
+        """!
+        @brief   How far along the current image acquisition is.
+        @returns The number of rows read so far, out of twice the image
+                 height because each subpage is read separately, or out of
+                 the image height in half frame mode
+        """
+        if self._state != MLX_Cam.S2_READ:
+            return self._subpage * self._height
+        return self._subpage * self._height + min(self._row, self._height)
+
+
+    @property
+    def width(self):
+        """!
+        @brief   The width of the camera's images in pixels.
+        """
+        return self._width
+
+
+    @property
+    def height(self):
+        """!
+        @brief   The height of the camera's images in pixels.
+        """
+        return self._height
+
+
+    @property
+    def image(self):
+        """!
+        @brief   The most recently completed image.
+        """
+        return self._image
+
+
+    @property
+    def foreground(self):
+        """!
+        @brief   The most recent image minus the learned background, as raw
+                 counts in an @c array('h'), or @c None if there is no
+                 background model. It can be searched with
+                 @c locate_target() or @c get_hot_column().
+        """
+        if self._background is None:
+            return None
+        return self._background.fg
+
+
+    @property
+    def learning(self):
+        """!
+        @brief   Whether the background is being learned; while not, the
+                 foreground is still updated, so someone standing in view
+                 isn't absorbed into the background.
+        """
+        return self._background is not None and not self._background.frozen
 
-        return image
+
+    @learning.setter
+    def learning(self, learn):
+        if self._background is not None:
+            self._background.frozen = not learn
+
+
+    def get_frame(self, age=0):
+        """!
+        @brief   Get a recent frame from the camera driver's frame ring.
+        @details Frames are not copied, so a frame is only valid until the
+                 ring wraps around to its slot again. Each frame is updated
+                 as every subpage is read, so consecutive frames differ by
+                 one subpage.
+        @param   age How many frames before the latest one to look back
+        @returns A raw image with @c seq, @c ticks, and @c sp_id attributes
+        """
+        return self._camera.frames.get(age)
 
 
 # The test code sets up the sensor, then grabs and shows an image in a terminal
@@ -241,8 +648,14 @@ if __name__ == "__main__":
     scanhex = [f"0x{addr:X}" for addr in i2c_bus.scan()]
     print(f"I2C Scan: {scanhex}")
 
-    # Create the camera object and set it up in default mode
-    camera = MLX_Cam(i2c_bus)
+    # Create the camera object and set it up in default mode, reporting how
+    # much memory the driver's setup needed at its peak
+    calibrated = False
+    gc.collect()
+    mem_before = gc.mem_free()
+    camera = MLX_Cam(i2c_bus, calibrated=calibrated)
+    print(f"Setup used {mem_before - camera._camera.min_free} bytes at peak, "
+          f"{mem_before - gc.mem_free()} bytes kept")
 
     while True:
         try:
@@ -250,6 +663,9 @@ if __name__ == "__main__":
             print("Click.", end='')
             t_1 = time.ticks_ms()
             image = camera.get_image()
+            if calibrated:
+                print(f" processed in {camera._camera.process_us} us/subpage",
+                      end='')
 
             # Can show image.v_ir, image.alpha, or image.buf; image.v_ir best?
             # Display pixellated grayscale or numbers in CSV format; the CSV
@@ -0,0 +1,268 @@
+"""!@file targeting.py
+@brief      Integer kernels which find the target in a thermal image.
+@details    Contains the column-sum kernel used by @c MLX_Cam.get_hot_column()
+            and @c MLX_Cam.locate_target(). The kernel works directly on the
+            raw @c array('h') pixel data with a preallocated accumulator, so no
+            memory is allocated per pixel.
+            If the board supports MicroPython's viper code emitter, the faster
+            version in @c targeting_viper.py is used; otherwise the pure
+            Python version below is used, which also runs under CPython and
+            gives identical results.
+
+            Running this file directly benchmarks both versions.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+# Import necessary modules.
+from array import array
+
+try:
+    from utime import ticks_us, ticks_diff
+except ImportError:
+    # Not on a MicroPython board; use the host's clock for the benchmark.
+    from time import perf_counter
+
+    def ticks_us():
+        return int(perf_counter() * 1_000_000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+try:
+    from targeting_viper import column_sums as column_sums_viper
+except (ImportError, SyntaxError, NameError):
+    # No viper code emitter on this port (or not running MicroPython at all).
+    column_sums_viper = None
+
+
+def make_accumulator(width, typecode='l', height=0):
+    """!@brief          Creates an accumulator for the column-sum kernel.
+        @param width    The number of columns in the image.
+        @param typecode @c 'l' for raw images, or @c 'f' for calibrated ones,
+                        which only the Python kernel can handle.
+        @param height   The number of rows in the image, if @c locate() will
+                        be used with this accumulator.
+        @return         An array with one sum per column followed by the
+                        image's minimum and maximum pixel values, then room
+                        for @c height row sums.
+    """
+    return array(typecode, [0] * (width + 2 + height))
+
+
+def column_sums(pix, acc, width, rows, size):
+    """!@brief          Adds up each column in the top rows of an image.
+        @details        Pure Python version of the kernel. Column sums of the
+                        first @c rows rows are stored in @c acc[0:width], and
+                        the minimum and maximum of the first @c size pixels are
+                        stored in @c acc[width] and @c acc[width + 1].
+        @param pix      The pixel data, a sequence of @c width columns per row.
+        @param acc      An accumulator made by @c make_accumulator().
+        @param width    The number of columns in the image.
+        @param rows     How many rows from the top of the image to add up.
+        @param size     The total number of pixels in the image.
+    """
+    for col in range(width):
+        acc[col] = 0
+    idx = 0
+    for row in range(rows):
+        for col in range(width):
+            acc[col] += pix[idx]
+            idx += 1
+    # The builtin min() and max() loop in C, so they are quicker here than
+    # folding the comparisons into the loop above.
+    if size == len(pix):
+        acc[width] = min(pix)
+        acc[width + 1] = max(pix)
+    else:
+        acc[width] = min(pix[idx] for idx in range(size))
+        acc[width + 1] = max(pix[idx] for idx in range(size))
+
+
+def hot_column(pix, acc, width, rows, even_bias=175, odd_bias=0, levels=10,
+               native=True):
+    """!@brief          Finds which column of an image is hottest.
+        @details        The image is mirrored left to right, as in
+                        @c MLX_Cam, so column 0 is the last column in memory.
+                        Each column's score is the sum of its top @c rows
+                        pixels plus a bias for even or odd columns. Biases are
+                        given in tenths of a brightness level, where the
+                        image's range is split into @c levels levels, so the
+                        default even column bias of 175 is 17.5 levels. All
+                        arithmetic is done with integers.
+        @param pix      The raw pixel data, an @c array('h').
+        @param acc      An accumulator made by @c make_accumulator().
+        @param width    The number of columns in the image.
+        @param rows     How many rows from the top of the image to add up.
+        @param even_bias Bias added to even columns, in tenths of a level.
+        @param odd_bias Bias added to odd columns, in tenths of a level.
+        @param levels   The number of brightness levels the biases refer to.
+        @param native   Whether to use the viper kernel if it is available.
+        @return         The hottest column, 0 to @c width - 1.
+    """
+    if native and column_sums_viper is not None:
+        column_sums_viper(pix, acc, width, rows, len(pix))
+    else:
+        column_sums(pix, acc, width, rows, len(pix))
+
+    # Scale everything by 10 * levels * range so the biases stay integers.
+    span = acc[width + 1] - acc[width]
+    sum_scale = 10 * levels
+    max_idx = 0
+    max_score = None
+    for col in range(width):
+        bias = even_bias if col % 2 == 0 else odd_bias
+        score = acc[width - col - 1] * sum_scale + bias * span
+        if max_score is None or score > max_score:
+            max_idx = col
+            max_score = score
+    return max_idx
+
+
+def _centroid(values, peak, start, stop, floor):
+    """!@brief          Finds the centre of the hot region around a peak.
+        @details        The region is the run of values above @c floor which
+                        contains the peak; each value is weighted by how far
+                        it is above the floor.
+        @param values   The values, such as column sums.
+        @param peak     Index of the highest value.
+        @param start    Index of the first value which may be used.
+        @param stop     One past the index of the last value which may be used.
+        @param floor    Values at or below this are not part of the region.
+        @return         The centre of the region, a fractional index.
+    """
+    lo = peak
+    while lo > start and values[lo - 1] > floor:
+        lo -= 1
+    hi = peak + 1
+    while hi < stop and values[hi] > floor:
+        hi += 1
+    weight = 0
+    moment = 0
+    for idx in range(lo, hi):
+        excess = values[idx] - floor
+        weight += excess
+        moment += excess * (idx - peak)
+    if weight <= 0:
+        return float(peak)
+    return peak + moment / weight
+
+
+def locate(pix, acc, width, height, rows, native=True, col_start=0,
+           col_stop=None):
+    """!@brief          Finds where the target is in an image, to a fraction
+                        of a pixel.
+        @details        Columns are added up over the top @c rows rows as in
+                        @c hot_column(), but without the column biases, and the
+                        target's column is the centroid of the hot region
+                        around the hottest column, counting only what is
+                        above halfway between the average and the hottest
+                        column. The rows of the hottest column and its
+                        neighbours are then added up and the target's row is
+                        found the same way. The image is mirrored left to
+                        right, as in @c hot_column().
+
+                        The confidence is how far the hottest column stands
+                        out from the average column, as a fraction of the
+                        image's range; a frame with nobody in it scores near 0.
+
+                        If only some columns hold fresh data, for example
+                        when a region of interest is being read, the search
+                        can be limited to them.
+        @param pix      The pixel data, an @c array('h') for raw images.
+        @param acc      An accumulator made by @c make_accumulator() with
+                        room for @c height row sums.
+        @param width    The number of columns in the image.
+        @param height   The number of rows in the image.
+        @param rows     How many rows from the top of the image to search.
+        @param native   Whether to use the viper kernel if it is available.
+        @param col_start First column to search, in memory order.
+        @param col_stop One past the last column to search, in memory order,
+                        or @c None for the rest of the row.
+        @return         A tuple of the target's row, its column, and a
+                        confidence from 0 to 1.
+    """
+    if native and column_sums_viper is not None:
+        column_sums_viper(pix, acc, width, rows, len(pix))
+    else:
+        column_sums(pix, acc, width, rows, len(pix))
+
+    # Hottest column, in memory order.
+    if col_stop is None:
+        col_stop = width
+    peak = col_start
+    total = acc[col_start]
+    for col in range(col_start + 1, col_stop):
+        total += acc[col]
+        if acc[col] > acc[peak]:
+            peak = col
+    mean = total / (col_stop - col_start)
+    col = width - 1 - _centroid(acc, peak, col_start, col_stop,
+                                (mean + acc[peak]) / 2)
+
+    span = acc[width + 1] - acc[width]
+    if span > 0:
+        confidence = (acc[peak] - mean) / (rows * span)
+        confidence = max(0.0, min(1.0, confidence))
+    else:
+        confidence = 0.0
+
+    # Row sums across the hottest column and its neighbours.
+    first = peak - 1 if peak > col_start else col_start
+    last = peak + 2 if peak < col_stop - 1 else col_stop
+    base = width + 2
+    best = base
+    total = 0
+    for row in range(rows):
+        idx = row * width
+        row_sum = 0
+        for n in range(first, last):
+            row_sum += pix[idx + n]
+        acc[base + row] = row_sum
+        total += row_sum
+        if row_sum > acc[best]:
+            best = base + row
+    floor = (total / rows + acc[best]) / 2
+    row = _centroid(acc, best, base, base + rows, floor) - base
+
+    return row, col, confidence
+
+
+if __name__ == "__main__":
+    # Benchmark both kernels on a synthetic frame with a warm blob in it.
+    width = 32
+    height = 24
+    pix = array('h', [0] * (width * height))
+    for idx in range(width * height):
+        row, col = divmod(idx, width)
+        pix[idx] = 600 + 7 * ((row * 13 + col * 29) % 17)
+        if 3 <= row <= 9 and 20 <= col <= 23:
+            pix[idx] += 900
+    acc = make_accumulator(width, height=height)
+    runs = 100
+
+    results = []
+    for native in (False, True):
+        if native and column_sums_viper is None:
+            print('viper kernel: not available on this platform')
+            continue
+        t_start = ticks_us()
+        for n in range(runs):
+            column = hot_column(pix, acc, width, height // 2, native=native)
+        per_call = ticks_diff(ticks_us(), t_start) / runs
+        name = 'viper kernel' if native else 'python kernel'
+        print(f'{name}: column {column}, {per_call:.1f} us per call')
+        results.append(column)
+
+    if len(results) == 2 and results[0] != results[1]:
+        print('kernels disagree!')
+
+    t_start = ticks_us()
+    for n in range(runs):
+        row, col, confidence = locate(pix, acc, width, height, height // 2,
+                                      native=False)
+    per_call = ticks_diff(ticks_us(), t_start) / runs
+    print(f'locate: row {row:.2f}, column {col:.2f}, confidence '
+          f'{confidence:.2f}, {per_call:.1f} us per call')
@@ -0,0 +1,55 @@
+"""!@file targeting_viper.py
+@brief      Viper versions of the kernels in targeting.py.
+@details    These are compiled to machine code by MicroPython's viper emitter,
+            so they only load on boards which support it; @c targeting.py
+            falls back to its pure Python kernels otherwise. Each function
+            here must give exactly the same results as its Python twin.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+import micropython
+
+
+@micropython.viper
+def column_sums(pix: ptr16, acc: ptr32, width: int, rows: int, size: int):
+    """!@brief          Viper version of @c targeting.column_sums().
+        @details        Makes one pass over the image, adding up the columns of
+                        the top @c rows rows and tracking the minimum and
+                        maximum pixel value of the whole image.
+        @param pix      The raw pixel data, an @c array('h').
+        @param acc      An @c array('l') accumulator of @c width + 2 entries.
+        @param width    The number of columns in the image.
+        @param rows     How many rows from the top of the image to add up.
+        @param size     The total number of pixels in the image.
+    """
+    col = 0
+    while col < width:
+        acc[col] = 0
+        col += 1
+
+    top = rows * width
+    lo = 32767
+    hi = -32768
+    col = 0
+    idx = 0
+    while idx < size:
+        # ptr16 reads are unsigned, so sign-extend the pixel value.
+        val = int(pix[idx])
+        if val & 0x8000:
+            val -= 0x10000
+        if val < lo:
+            lo = val
+        if val > hi:
+            hi = val
+        if idx < top:
+            acc[col] = acc[col] + val
+        col += 1
+        if col == width:
+            col = 0
+        idx += 1
+
+    acc[width] = lo
+    acc[width + 1] = hi
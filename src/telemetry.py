@@ -0,0 +1,218 @@
+"""!@file telemetry.py
+@brief      Records the control loop's state for plotting on a host.
+@details    Contains the @c Telemetry class, a ring of fixed size binary
+            records in one preallocated @c bytearray. Each control period a
+            record of the loop's time and, for both axes, the setpoint,
+            position, velocity and actuation is packed into the next slot, so
+            recording allocates no memory beyond the values themselves. When
+            the ring is full the oldest records are overwritten.
+
+            Records are sent to a stream, such as @c pyb.USB_VCP(), in blocks
+            of consecutive records straight from the ring. @c drain() sends a
+            limited number at a time, so it can be called whenever the loop
+            has nothing else to do; to a USB port it only sends while a host
+            is connected and the port has room for the whole block, so it
+            never waits for the host to read. Block layout, all little-endian:
+
+            | Offset | Type      | Field                                    |
+            |--------|-----------|------------------------------------------|
+            | 0      | char[4]   | magic, @c b'MLXT'                        |
+            | 4      | uint16    | number of records in the block           |
+            | 6      | uint16    | size of each record in bytes             |
+            | 8      | uint32    | sequence number of the first record      |
+            | 12     | records   | the records, oldest first                |
+            | 12 + n | uint32    | CRC-32 of the header and records         |
+
+            Record layout:
+
+            | Offset | Type      | Field                                    |
+            |--------|-----------|------------------------------------------|
+            | 0      | uint32    | @c ticks_us() when the period started    |
+            | 4      | float32   | yaw setpoint in radians                  |
+            | 8      | float32   | yaw position in radians                  |
+            | 12     | float32   | yaw velocity in radians per second       |
+            | 16     | float32   | yaw actuation in percent duty cycle      |
+            | 20     | float32[4]| the same for pitch                       |
+
+            The host decoder is @c tools/telemetry_decoder.py; gaps in the
+            sequence numbers show where records were overwritten or lost.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+# Import necessary modules.
+from binascii import crc32
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+try:
+    import uselect as select
+except ImportError:
+    import select
+
+## Magic bytes at the start of every block.
+BLOCK_MAGIC = b'MLXT'
+## Block header layout, see the table above.
+BLOCK_FORMAT = '<4sHHI'
+## Size of a block header in bytes.
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_FORMAT)
+## Size of the CRC after the records in bytes.
+CRC_SIZE = 4
+## Record layout, see the table above.
+RECORD_FORMAT = '<I8f'
+## Size of a record in bytes.
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+## Bytes free in the USB port's transmit buffer when it polls as writable,
+#  half of the 1 kB buffer on the STM32 port.
+USB_TX_ROOM = 512
+## The most records in a block which fits in @c USB_TX_ROOM, for
+#  @c max_drain when streaming over USB.
+USB_MAX_DRAIN = (USB_TX_ROOM - BLOCK_HEADER_SIZE - CRC_SIZE) // RECORD_SIZE
+
+
+class Telemetry:
+    """!@brief      A ring of control loop records, sent to a stream in blocks.
+    """
+
+    def __init__(self, capacity=256, stream=None, max_drain=32):
+        """!@brief          Creates an empty telemetry ring.
+            @param capacity How many records the ring holds; at 36 bytes each
+                            the default is 2.56 s of 10 ms periods.
+            @param stream   A binary stream with a @c write() method to drain
+                            records to, or @c None to only keep them.
+            @param max_drain The most records @c drain() sends at once; for a
+                            USB port, @c USB_MAX_DRAIN or fewer so that a
+                            block never has to wait for room.
+        """
+        ## The stream records are drained to, if any.
+        self.stream = stream
+        ## The most records sent by one call to @c drain().
+        self.max_drain = max_drain
+        ## Sequence number of the next record.
+        self.seq = 0
+        ## Number of records overwritten before they were drained.
+        self.dropped = 0
+        self._capacity = capacity
+        self._ring = bytearray(capacity * RECORD_SIZE)
+        self._view = memoryview(self._ring)
+        self._header = bytearray(BLOCK_HEADER_SIZE)
+        self._crc = bytearray(CRC_SIZE)
+        self._head = 0
+        self._count = 0
+        # Polls a USB port for room to send a block without waiting
+        self._poll = None
+        if hasattr(stream, 'isconnected'):
+            self._poll = select.poll()
+            self._poll.register(stream, select.POLLOUT)
+
+    def __len__(self):
+        """!@brief          The number of records waiting to be drained.
+        """
+        return self._count
+
+    def record(self, ticks, yaw_set, yaw_pos, yaw_vel, yaw_act,
+               pitch_set, pitch_pos, pitch_vel, pitch_act):
+        """!@brief          Records one control period.
+            @param ticks    @c ticks_us() when the period started.
+            @param yaw_set  The yaw setpoint in radians.
+            @param yaw_pos  The yaw position in radians.
+            @param yaw_vel  The yaw velocity in radians per second.
+            @param yaw_act  The yaw actuation in percent duty cycle.
+            @param pitch_set The pitch setpoint in radians.
+            @param pitch_pos The pitch position in radians.
+            @param pitch_vel The pitch velocity in radians per second.
+            @param pitch_act The pitch actuation in percent duty cycle.
+        """
+        struct.pack_into(RECORD_FORMAT, self._ring, self._head * RECORD_SIZE,
+                         ticks & 0xFFFFFFFF, yaw_set, yaw_pos, yaw_vel,
+                         yaw_act, pitch_set, pitch_pos, pitch_vel, pitch_act)
+        self._head += 1
+        if self._head == self._capacity:
+            self._head = 0
+        self.seq += 1
+        if self._count < self._capacity:
+            self._count += 1
+        else:
+            self.dropped += 1
+
+    def drain(self, stream=None, max_records=None):
+        """!@brief          Sends the oldest waiting records as one block.
+            @details        Only records which are next to each other in the
+                            ring are sent at once, so when the waiting records
+                            wrap around the end of the ring it takes two calls
+                            to send them all.
+            @param stream   The stream to write to, by default @c self.stream.
+            @param max_records The most records to send, by default
+                            @c self.max_drain.
+            @return         The number of records sent.
+        """
+        stream = stream or self.stream
+        if stream is None or not self._count:
+            return 0
+        connected = getattr(stream, 'isconnected', None)
+        if connected is not None and not connected():
+            return 0
+        if (stream is self.stream and self._poll is not None
+                and not self._poll.poll(0)):
+            # The host hasn't read what was sent before
+            return 0
+        tail = self._head - self._count
+        if tail < 0:
+            tail += self._capacity
+        count = min(self._count, self._capacity - tail,
+                    max_records or self.max_drain)
+
+        struct.pack_into(BLOCK_FORMAT, self._header, 0, BLOCK_MAGIC, count,
+                         RECORD_SIZE, (self.seq - self._count) & 0xFFFFFFFF)
+        records = self._view[tail * RECORD_SIZE:(tail + count) * RECORD_SIZE]
+        struct.pack_into('<I', self._crc, 0,
+                         crc32(records, crc32(self._header)) & 0xFFFFFFFF)
+        stream.write(self._header)
+        stream.write(records)
+        stream.write(self._crc)
+        self._count -= count
+        return count
+
+    def save(self, path):
+        """!@brief          Writes every waiting record to a file.
+            @details        The file holds blocks just as they are sent over
+                            USB, so the host decoder reads either.
+            @param path     The file's path, such as @c 'telemetry.bin'.
+            @return         The number of records written.
+        """
+        total = 0
+        with open(path, 'wb') as file:
+            while self._count:
+                total += self.drain(file, self._capacity)
+        return total
+
+
+if __name__ == "__main__":
+    # Record a few seconds of a made up control loop and time the recording.
+    import math
+    try:
+        from utime import ticks_us, ticks_diff
+    except ImportError:
+        from time import perf_counter
+
+        def ticks_us():
+            return int(perf_counter() * 1_000_000)
+
+        def ticks_diff(end, start):
+            return end - start
+
+    telemetry = Telemetry()
+    t_start = ticks_us()
+    for n in range(500):
+        angle = math.sin(n / 50)
+        telemetry.record(ticks_us(), angle, angle * .9, angle * 2, 10 * angle,
+                         -angle, -angle * .9, -angle * 2, -10 * angle)
+    per_record = ticks_diff(ticks_us(), t_start) / 500
+    print(f'{per_record:.1f} us per record, {len(telemetry)} waiting, '
+          f'{telemetry.dropped} overwritten')
+    print(f'{telemetry.save("telemetry.bin")} records saved')
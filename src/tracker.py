@@ -0,0 +1,164 @@
+"""!@file tracker.py
+@brief      Tracks the target between camera images.
+@details    Contains an alpha-beta filter, a constant-velocity estimator which
+            blends each new detection with where the target was predicted to
+            be. Between images it predicts where the target is now, so the
+            turret can keep following a moving target instead of holding the
+            angle from the last picture.
+
+            Times are in milliseconds from @c ticks_ms(), and positions are in
+            image columns or rows.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+# Import necessary modules.
+try:
+    from utime import ticks_diff
+except ImportError:
+    # Not on a MicroPython board; ticks are plain integers.
+    def ticks_diff(end, start):
+        return end - start
+
+
+class AlphaBetaFilter:
+    """!@brief      Estimates the position and velocity of one coordinate.
+    """
+
+    def __init__(self, alpha=0.6, beta=0.2, max_speed=20.0, max_horizon=1000,
+                 lower=None, upper=None):
+        """!@brief          Creates a filter with no estimate yet.
+            @param alpha    How much of each position error is corrected, 0 to 1.
+            @param beta     How much of each position error is turned into a
+                            velocity correction, 0 to 1.
+            @param max_speed The largest velocity estimate allowed, in units/s.
+            @param max_horizon How far ahead to predict at most, in ms.
+            @param lower    Smallest position to predict, or @c None.
+            @param upper    Largest position to predict, or @c None.
+        """
+        ## Position correction gain.
+        self.alpha = alpha
+        ## Velocity correction gain.
+        self.beta = beta
+        ## Largest velocity estimate allowed in units per second.
+        self.max_speed = max_speed
+        ## How far ahead to predict at most in ms.
+        self.max_horizon = max_horizon
+        ## Smallest position to predict.
+        self.lower = lower
+        ## Largest position to predict.
+        self.upper = upper
+        self.reset()
+
+    def reset(self):
+        """!@brief          Forgets the current estimate.
+        """
+        ## Estimated position at the time of the last update.
+        self.pos = None
+        ## Estimated velocity in units per second.
+        self.vel = 0.0
+        ## Time of the last update in ms.
+        self.t_last = None
+
+    def update(self, pos, t):
+        """!@brief          Corrects the estimate with a new measurement.
+            @param pos      The measured position.
+            @param t        When it was measured, from @c ticks_ms().
+        """
+        if self.pos is None:
+            self.pos = float(pos)
+            self.vel = 0.0
+            self.t_last = t
+            return
+
+        dt = ticks_diff(t, self.t_last) / 1000
+        if dt <= 0:
+            # Same instant as the last update; just average the positions.
+            self.pos += self.alpha * (pos - self.pos)
+            return
+        predicted = self.pos + self.vel * dt
+        error = pos - predicted
+        self.pos = predicted + self.alpha * error
+        vel = self.vel + self.beta * error / dt
+        self.vel = max(-self.max_speed, min(self.max_speed, vel))
+        self.t_last = t
+
+    def predict(self, t):
+        """!@brief          Estimates the position at a given time.
+            @param t        The time, from @c ticks_ms().
+            @return         The estimated position, or @c None if the filter
+                            has not had a measurement yet.
+        """
+        if self.pos is None:
+            return None
+        dt = min(ticks_diff(t, self.t_last), self.max_horizon) / 1000
+        pos = self.pos + self.vel * max(dt, 0)
+        if self.lower is not None and pos < self.lower:
+            pos = self.lower
+        if self.upper is not None and pos > self.upper:
+            pos = self.upper
+        return pos
+
+
+class TargetTracker:
+    """!@brief      Tracks the target's column and row in the camera image.
+    """
+
+    def __init__(self, width=32, height=24, alpha=0.6, beta=0.2,
+                 max_speed=20.0, max_horizon=1000):
+        """!@brief          Creates a tracker with no target yet.
+            @param width    The number of columns in the image.
+            @param height   The number of rows in the image.
+            @param alpha    Position correction gain of both filters.
+            @param beta     Velocity correction gain of both filters.
+            @param max_speed The fastest the target can move, in pixels/s.
+            @param max_horizon How far ahead to predict at most, in ms.
+        """
+        ## Filter for the target's column.
+        self.col = AlphaBetaFilter(alpha, beta, max_speed, max_horizon,
+                                   0, width - 1)
+        ## Filter for the target's row.
+        self.row = AlphaBetaFilter(alpha, beta, max_speed, max_horizon,
+                                   0, height - 1)
+
+    def reset(self):
+        """!@brief          Forgets the target.
+        """
+        self.col.reset()
+        self.row.reset()
+
+    def update(self, t, col, row=None):
+        """!@brief          Adds a detection of the target.
+            @param t        When the image was taken, from @c ticks_ms().
+            @param col      The column the target was found in.
+            @param row      The row the target was found in, if known.
+        """
+        self.col.update(col, t)
+        if row is not None:
+            self.row.update(row, t)
+
+    def predict_col(self, t):
+        """!@brief          Estimates which column the target is in now.
+            @param t        The time, from @c ticks_ms().
+            @return         The column, or @c None if there is no target yet.
+        """
+        return self.col.predict(t)
+
+    def predict_row(self, t):
+        """!@brief          Estimates which row the target is in now.
+            @param t        The time, from @c ticks_ms().
+            @return         The row, or @c None if no row has been measured.
+        """
+        return self.row.predict(t)
+
+
+if __name__ == "__main__":
+    # Track a target moving at 4 columns per second, seen once a second.
+    tracker = TargetTracker()
+    for t in range(0, 6000, 1000):
+        tracker.update(t, 4 + 4 * t / 1000)
+        print(f't={t} ms: seen at {4 + 4 * t / 1000:.1f}, '
+              f'predicted {tracker.predict_col(t + 500):.2f} '
+              f'for t={t + 500} ms')
@@ -0,0 +1,102 @@
+"""!@file frame_log_reader.py
+@brief      Reads binary frame logs written by @c src/frame_log.py on a host.
+@details    The log is memory-mapped and viewed as a NumPy structured array
+            of records, so even hours of frames open instantly and nothing is
+            copied until it is used. The pixels of all frames are available
+            as one @c (n, 24, 32) int16 array with @c frames['pix'].
+
+            Running this file with a log's path prints a summary of it; with
+            no arguments it records frames from the emulated camera in
+            @c mlx90640_emulator.py and checks they read back unchanged.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+from frame_log import RECORD_MAGIC, RECORD_SIZE, FRAME_PIXELS
+
+## NumPy layout of one record; must match @c frame_log.HEADER_FORMAT.
+RECORD_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('seq', '<u4'),
+    ('ticks_us', '<u4'),
+    ('sp_id', 'u1'),
+    ('pattern_id', 'u1'),
+    ('n_pixels', '<u2'),
+    ('yaw', '<i4'),
+    ('pitch', '<i4'),
+    ('pix', '<i2', (24, 32)),
+])
+assert RECORD_DTYPE.itemsize == RECORD_SIZE
+
+
+def read_frames(path, check=True):
+    """!@brief          Memory-maps a frame log.
+        @details        A partly written record at the end of the file, as
+                        left by a power cut, is ignored.
+        @param path     The log file's path.
+        @param check    Whether to check every record's magic and size.
+        @return         A read-only structured array of records.
+    """
+    count = os.path.getsize(path) // RECORD_SIZE
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    frames = np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+    if check:
+        bad = np.flatnonzero((frames['magic'] != RECORD_MAGIC)
+                             | (frames['n_pixels'] != FRAME_PIXELS))
+        if len(bad):
+            raise ValueError(f'{path}: record {bad[0]} is corrupt')
+    return frames
+
+
+def frame_times(frames):
+    """!@brief          Times of each frame in seconds since the first one.
+        @details        Unwraps the board's 32-bit microsecond counter.
+        @param frames   Records from @c read_frames().
+    """
+    ticks = frames['ticks_us'].astype(np.int64)
+    steps = np.diff(ticks) % (1 << 32)
+    return np.concatenate(([0], np.cumsum(steps))) / 1e6
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        frames = read_frames(sys.argv[1])
+        times = frame_times(frames)
+        print(f'{len(frames)} frames over {times[-1] if len(times) else 0:.1f} s')
+        if len(frames):
+            pix = frames['pix']
+            print(f'pixels {pix.min()} to {pix.max()}, '
+                  f'sequence {frames["seq"][0]} to {frames["seq"][-1]}')
+        sys.exit()
+
+    import tempfile
+    from mlx90640_emulator import EmulatedBus
+    from mlx_cam import MLX_Cam
+    from frame_log import open_log
+
+    camera = MLX_Cam(EmulatedBus(), frames=2)
+    path = os.path.join(tempfile.mkdtemp(), 'frames.bin')
+    log = open_log(path)
+    expected = []
+    for n in range(6):
+        camera.get_image()
+        frame = camera.get_frame()
+        log.write(frame, yaw=n, pitch=-n)
+        expected.append(list(frame.pix))
+    log.close()
+
+    frames = read_frames(path)
+    ok = all(frames['pix'][n].ravel().tolist() == expected[n]
+             for n in range(len(expected)))
+    print(f'{len(frames)} frames read back, '
+          f'{"all match" if ok else "MISMATCH"}')
@@ -0,0 +1,131 @@
+"""!@file render_benchmark.py
+@brief      Times the text renderers of @c MLX_Cam against their old versions.
+@details    Takes images from the emulated camera in @c mlx90640_emulator.py
+            and renders each with @c ascii_image(), @c ascii_art() and
+            @c get_csv(), both as they are now and as they were when every
+            pixel was printed on its own. Output goes to an in-memory stream
+            so only the time spent formatting is measured. Every renderer
+            must come out exactly as before, byte for byte.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+import io
+import time
+from contextlib import redirect_stdout
+
+from mlx90640_emulator import EmulatedBus, synthetic_frames
+from mlx_cam import MLX_Cam
+
+
+def old_ascii_image(camera, array, pixel="██", textcolor="0;180;0"):
+    """!@brief          @c MLX_Cam.ascii_image() as it was.
+    """
+    minny = min(array)
+    scale = 255.0 / (max(array) - minny)
+    for row in range(camera._height):
+        for col in range(camera._width):
+            pix = int((array[row * camera._width + (camera._width - col - 1)]
+                       - minny) * scale)
+            print(f"\033[38;2;{pix};{pix};{pix}m{pixel}", end='')
+        print(f"\033[38;2;{textcolor}m")
+
+
+def old_ascii_art(camera, array):
+    """!@brief          @c MLX_Cam.ascii_art() as it was.
+    """
+    scale = len(MLX_Cam.asc) / (max(array) - min(array))
+    offset = -min(array)
+    for row in range(camera._height):
+        for col in range(camera._width):
+            pix = int((array[row * camera._width + (camera._width - col - 1)]
+                       + offset) * scale)
+            try:
+                the_char = MLX_Cam.asc[pix]
+                print(f"{the_char}{the_char}", end='')
+            except IndexError:
+                print("><", end='')
+        print('')
+
+
+def old_get_csv(camera, array, limits=None):
+    """!@brief          @c MLX_Cam.get_csv() as it was.
+    """
+    if limits and len(limits) == 2:
+        scale = (limits[1] - limits[0]) / (max(array) - min(array))
+        offset = limits[0] - min(array)
+    else:
+        offset = 0.0
+        scale = 1.0
+    for row in range(camera._height):
+        line = ""
+        for col in range(camera._width):
+            pix = int((array[row * camera._width + (camera._width - col - 1)]
+                      + offset) * scale)
+            if col:
+                line += ","
+            line += f"{pix}"
+        yield line
+
+
+def render(function, repeats):
+    """!@brief          Runs a renderer which prints, capturing its output.
+        @return         A tuple of the output and the milliseconds per call.
+    """
+    out = io.StringIO()
+    t_start = time.perf_counter()
+    with redirect_stdout(out):
+        for n in range(repeats):
+            out.seek(0)
+            out.truncate()
+            function()
+    return out.getvalue(), (time.perf_counter() - t_start) * 1000 / repeats
+
+
+def write(function, repeats):
+    """!@brief          Runs a renderer which writes to a binary stream.
+        @return         A tuple of the output and the milliseconds per call.
+    """
+    out = io.BytesIO()
+    t_start = time.perf_counter()
+    for n in range(repeats):
+        out.seek(0)
+        out.truncate()
+        function(out)
+    return out.getvalue().decode(), (time.perf_counter() - t_start) * 1000 / repeats
+
+
+if __name__ == "__main__":
+    repeats = 20
+    camera = MLX_Cam(EmulatedBus(frames=list(synthetic_frames(4))))
+    failures = 0
+    for n in range(3):
+        pix = camera.get_image().pix
+        results = (
+            ("ascii_image",
+             render(lambda: old_ascii_image(camera, pix), repeats),
+             write(lambda out: camera.ascii_image(pix, stream=out), repeats)),
+            ("ascii_art",
+             render(lambda: old_ascii_art(camera, pix), repeats),
+             write(lambda out: camera.ascii_art(pix, stream=out), repeats)),
+            ("get_csv",
+             render(lambda: print('\n'.join(old_get_csv(camera, pix,
+                                                        (0, 99)))),
+                    repeats),
+             render(lambda: print('\n'.join(camera.get_csv(pix, (0, 99)))),
+                    repeats)),
+            ("write_csv",
+             render(lambda: print('\n'.join(old_get_csv(camera, pix))),
+                    repeats),
+             write(lambda out: camera.write_csv(pix, out), repeats)),
+        )
+        for name, (old, old_ms), (new, new_ms) in results:
+            same = old == new
+            failures += not same
+            print(f"frame {n} {name}: {old_ms:.2f} ms before, "
+                  f"{new_ms:.2f} ms now, "
+                  f"{len(old)} -> {len(new)} characters"
+                  f"{'' if same else ', OUTPUT DIFFERS'}")
+    print(f"{failures} renders did not match")
@@ -0,0 +1,195 @@
+"""!@file telemetry_decoder.py
+@brief      Decodes control loop telemetry from @c src/telemetry.py on a host.
+@details    Blocks of records, read from the board's USB port or from a file
+            saved on its flash, are fed to a @c TelemetryDecoder, which finds
+            them by their magic bytes, checks their CRCs and hands out the
+            records as a NumPy structured array with one field per column,
+            ready to plot. Anything between blocks, such as text printed by
+            the board or camera frames from @c frame_stream.py, is skipped.
+
+            Running this file with a saved file or a serial port (with
+            pyserial installed) prints a summary of the records and plots
+            them if matplotlib is installed; with no arguments it checks
+            that records from @c Telemetry read back unchanged.
+@author     Nathan Dodd
+@author     Lewis Kanagy
+@author     Sean Wahl
+@date       March 20, 2023
+"""
+
+import os
+import sys
+import struct
+import zlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+from telemetry import (BLOCK_MAGIC, BLOCK_FORMAT, BLOCK_HEADER_SIZE, CRC_SIZE,
+                       RECORD_SIZE)
+
+## NumPy layout of one record; must match @c telemetry.RECORD_FORMAT.
+RECORD_DTYPE = np.dtype([
+    ('ticks_us', '<u4'),
+    ('yaw_set', '<f4'),
+    ('yaw_pos', '<f4'),
+    ('yaw_vel', '<f4'),
+    ('yaw_act', '<f4'),
+    ('pitch_set', '<f4'),
+    ('pitch_pos', '<f4'),
+    ('pitch_vel', '<f4'),
+    ('pitch_act', '<f4'),
+])
+assert RECORD_DTYPE.itemsize == RECORD_SIZE
+
+## MicroPython's @c ticks_us() wraps around at this value.
+TICKS_PERIOD = 1 << 30
+
+
+class TelemetryDecoder:
+    """!@brief      Turns a byte stream from the board into records.
+    """
+
+    def __init__(self):
+        ## Number of blocks which failed their CRC.
+        self.corrupt = 0
+        ## Number of records missing from the sequence so far.
+        self.lost = 0
+        ## Sequence number of the next record expected.
+        self.next_seq = None
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """!@brief          Decodes the blocks completed by some bytes.
+            @param data     Bytes read from the board.
+            @return         A structured array of the new records.
+        """
+        buf = self._buf
+        buf += data
+        blocks = []
+        while True:
+            start = buf.find(BLOCK_MAGIC)
+            if start < 0:
+                # Keep a tail which might be the start of the magic
+                del buf[:max(0, len(buf) - len(BLOCK_MAGIC) + 1)]
+                break
+            del buf[:start]
+            if len(buf) < BLOCK_HEADER_SIZE:
+                break
+            _, count, size, seq = struct.unpack_from(BLOCK_FORMAT, buf)
+            if size != RECORD_SIZE:
+                # Not really a block; look for the next one
+                self.corrupt += 1
+                del buf[:1]
+                continue
+            end = BLOCK_HEADER_SIZE + count * size
+            if len(buf) < end + CRC_SIZE:
+                break
+            crc, = struct.unpack_from('<I', buf, end)
+            if zlib.crc32(buf[:end]) != crc:
+                self.corrupt += 1
+                del buf[:1]
+                continue
+            blocks.append(np.frombuffer(bytes(buf[BLOCK_HEADER_SIZE:end]),
+                                        RECORD_DTYPE))
+            del buf[:end + CRC_SIZE]
+            if self.next_seq is not None:
+                self.lost += (seq - self.next_seq) & 0xFFFFFFFF
+            self.next_seq = (seq + count) & 0xFFFFFFFF
+        if not blocks:
+            return np.zeros(0, RECORD_DTYPE)
+        return np.concatenate(blocks)
+
+
+def read_telemetry(path):
+    """!@brief          Reads a telemetry file saved by @c Telemetry.save().
+        @param path     The file's path.
+        @return         A structured array of records.
+    """
+    with open(path, 'rb') as file:
+        return TelemetryDecoder().feed(file.read())
+
+
+def record_times(records):
+    """!@brief          Times of each record in seconds since the first one.
+        @details        Unwraps the board's microsecond counter.
+        @param records  Records from @c TelemetryDecoder.feed().
+    """
+    ticks = records['ticks_us'].astype(np.int64)
+    steps = np.diff(ticks) % TICKS_PERIOD
+    return np.concatenate(([0], np.cumsum(steps))) / 1e6
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        if os.path.isfile(sys.argv[1]):
+            records = read_telemetry(sys.argv[1])
+        else:
+            import serial
+
+            port = serial.Serial(sys.argv[1], timeout=1)
+            decoder = TelemetryDecoder()
+            parts = []
+            print('Recording; press Ctrl-C to stop')
+            try:
+                while True:
+                    parts.append(decoder.feed(port.read(port.in_waiting or 1)))
+            except KeyboardInterrupt:
+                pass
+            records = np.concatenate(parts)
+            print(f'{decoder.lost} records lost, {decoder.corrupt} corrupt')
+        times = record_times(records)
+        print(f'{len(records)} records over '
+              f'{times[-1] if len(times) else 0:.2f} s')
+        if len(records) > 1:
+            periods = np.diff(times) * 1000
+            print(f'period {periods.mean():.2f} ms mean, '
+                  f'{periods.max():.2f} ms longest')
+        try:
+            import matplotlib.pyplot as plt
+        except ImportError:
+            sys.exit()
+        fig, axes = plt.subplots(3, 2, sharex=True)
+        for col, axis in enumerate(('yaw', 'pitch')):
+            axes[0, col].plot(times, records[f'{axis}_set'], label='setpoint')
+            axes[0, col].plot(times, records[f'{axis}_pos'], label='position')
+            axes[0, col].set_title(axis)
+            axes[0, col].legend()
+            axes[1, col].plot(times, records[f'{axis}_vel'])
+            axes[1, col].set_ylabel('rad/s')
+            axes[2, col].plot(times, records[f'{axis}_act'])
+            axes[2, col].set_ylabel('duty %')
+            axes[2, col].set_xlabel('s')
+        plt.show()
+        sys.exit()
+
+    import io
+    from telemetry import Telemetry
+
+    telemetry = Telemetry(capacity=64, max_drain=20)
+    out = io.BytesIO()
+    expected = []
+    ticks = TICKS_PERIOD - 25_000
+    for n in range(300):
+        values = [n * .5 + k for k in range(8)]
+        telemetry.record(ticks, *values)
+        expected.append([ticks] + values)
+        ticks = (ticks + 10_000) % TICKS_PERIOD
+        # Stop draining for a while so the oldest records are overwritten
+        if n % 7 == 0 and not 100 <= n < 250:
+            telemetry.drain(out)
+        if n == 150:
+            out.write(b'Click\r\n')
+    while telemetry.drain(out):
+        pass
+    decoder = TelemetryDecoder()
+    records = decoder.feed(out.getvalue())
+    got = [[int(r[0])] + [float(v) for v in list(r)[1:]] for r in records]
+    remaining = iter(expected)
+    ok = (all(record in remaining for record in got)
+          and len(got) + decoder.lost == 300)
+    periods = np.diff(record_times(records))
+    print(f'{len(records)} records decoded, {decoder.lost} overwritten, '
+          f'{"all match" if ok else "MISMATCH"}; periods '
+          f'{periods.min() * 1000:.0f} to {periods.max() * 1000:.0f} ms')